@@ -1,101 +1,117 @@
-from db import get_connection
-from datetime import datetime
-from collections import defaultdict
-import sqlite3
+from db import get_connection, get_metadata, set_metadata, RETURN_HISTOGRAM_BIN_WIDTH
+from config import (
+    RATE_BUCKET_THRESHOLDS, FIGURE_WORKERS, FIGURE_POOL_MIN_FIGURES, BENCHMARK_TICKER,
+    ANALYSIS_DATA_DIR, ANALYSIS_BY_RATE_BUCKET
+)
+from event_study import window_label
+from instrumentation import timed
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import hashlib
+import json
+import multiprocessing
+import os
+import numpy as np
+import matplotlib
+
+# Figures are only ever written to disk; never pick an interactive backend
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-from statistics import median
 
-def load_interest_rates():
-    conn = get_connection()
-    cur = conn.cursor()
-    
+def load_interest_rates(series_id: str = "DGS10", data_dir=ANALYSIS_DATA_DIR):
+    # Days since epoch + value for every business day (already forward-filled), ascending
+    if data_dir:
+        import dataset_io
+        return dataset_io.rates_from_files(data_dir, series_id)
+
+    cur = get_connection().cursor()
+
     cur.execute("""
-        SELECT date, treasury_10y
-        FROM interest_rates
-        WHERE treasury_10y IS NOT NULL
+        SELECT CAST(julianday(date) - 2440587.5 AS INTEGER), value
+        FROM rates_daily
+        WHERE series_id = ?
         ORDER BY date
-    """)
+    """, (series_id,))
 
     rows = cur.fetchall()
-    conn.close()
 
-    rates = []
-    for date_str, value in rows:
-        
-        try:
-            d = datetime.fromisoformat(date_str).date()
-            rates.append((d, float(value)))
-        
-        except Exception:
-            continue
+    if not rows:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
 
-    return rates
+    days, values = zip(*rows)
+    return np.array(days, dtype=np.int32), np.array(values, dtype=np.float64)
 
 
-def get_latest_rate_on_or_before(target_date, rates):
-    latest = None
-    
-    for d, r in rates:
-        
-        if d <= target_date:
-            latest = r
-        
-        else:
-            # Because rates are sorted ascending, once d > target_date we can stop
-            break
+def asof_join(target_days, rate_days, rate_values):
+    # Latest rate on or before each target day, in one searchsorted pass (NaN if none yet)
+    idx = np.searchsorted(rate_days, target_days, side="right") - 1
+    out = np.full(len(target_days), np.nan)
+    found = idx >= 0
+    out[found] = rate_values[idx[found]]
+    return out
 
-    return latest
 
+def rate_bucket_labels(thresholds):
+    cuts = [f"{t:g}" for t in thresholds]
+    labels = [f"<{cuts[0]}%"] + [f"{lo}-{hi}%" for lo, hi in zip(cuts, cuts[1:])] + [f">={cuts[-1]}%"]
+
+    if len(labels) == 3:
+        labels = [f"{name} ({label})" for name, label in zip(("Low", "Medium", "High"), labels)]
+
+    return labels
 
 
 # FILINGS BY RATE BUCKET
 
-def calculate_filings_by_rate_bucket():
-    rates = load_interest_rates()
-    
-    if not rates:
-        print("No interest-rate data found in DB.")
-        return {}
+def load_filing_day_counts(data_dir=ANALYSIS_DATA_DIR):
+    # (days since epoch, filings on that day) from the trigger-maintained filings_daily table
+    if data_dir:
+        import dataset_io
+        return np.unique(dataset_io.filing_days_from_files(data_dir), return_counts=True)
 
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT id, filing_date FROM filings")
-    
-    filings = cur.fetchall()
-    
-    conn.close()
+    cur = get_connection().cursor()
+
+    # Skip weird dates
+    cur.execute("""
+        SELECT CAST(julianday(day) - 2440587.5 AS INTEGER), n
+        FROM filings_daily
+        WHERE n > 0 AND julianday(day) IS NOT NULL
+        ORDER BY day
+    """)
+
+    rows = cur.fetchall()
 
-    buckets = defaultdict(int)
+    if not rows:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
 
-    for filing_id, filing_date_str in filings:
-    
-        try:
-            filing_date = datetime.fromisoformat(filing_date_str).date()
+    days, counts = zip(*rows)
+    return np.array(days, dtype=np.int32), np.array(counts, dtype=np.int64)
+
+
+def calculate_filings_by_rate_bucket(thresholds=RATE_BUCKET_THRESHOLDS, data_dir=ANALYSIS_DATA_DIR):
+    rate_days, rate_values = load_interest_rates(data_dir=data_dir)
     
-        except Exception:
-            # Skip weird dates
-            continue
+    if len(rate_days) == 0:
+        print("No interest-rate data found in DB.")
+        return {}
 
-        rate = get_latest_rate_on_or_before(filing_date, rates)
-        
-        if rate is None:
-            # No rate available on or before this date
-            continue
+    filing_days, day_counts = load_filing_day_counts(data_dir)
 
-        if rate < 2.0:
-            bucket = "Low (<2%)"
-        elif rate < 4.0:
-            bucket = "Medium (2-4%)"
-        else:
-            bucket = "High (>=4%)"
+    rates = asof_join(filing_days, rate_days, rate_values)
+
+    # No rate available on or before these dates
+    has_rate = ~np.isnan(rates)
+    rates, day_counts = rates[has_rate], day_counts[has_rate]
 
-        buckets[bucket] += 1
+    thresholds = sorted(thresholds)
+    labels = rate_bucket_labels(thresholds)
+    buckets = np.searchsorted(thresholds, rates, side="right")
+    counts = np.bincount(buckets, weights=day_counts, minlength=len(labels)).astype(np.int64)
 
-    return dict(buckets)
+    return {label: int(n) for label, n in zip(labels, counts) if n}
 
 
-def plot_filings_by_rate_bucket(bucket_counts):
+def plot_filings_by_rate_bucket(bucket_counts, filename="fig1_filings_by_rate_bucket.png"):
     if not bucket_counts:
         print("No bucket counts to plot.")
         return
@@ -114,30 +130,33 @@ def plot_filings_by_rate_bucket(bucket_counts):
         plt.text(i, v + 0.1, str(v), ha="center", va="bottom")
 
     plt.tight_layout()
-    plt.savefig("fig1_filings_by_rate_bucket.png", bbox_inches="tight")
-    plt.show()
+    plt.savefig(filename, bbox_inches="tight")
+    plt.close()
 
 
 # FILINGS OVER TIME
-def calculate_filings_per_month():
-    conn = get_connection()
-    cur = conn.cursor()
+def calculate_filings_per_month(data_dir=ANALYSIS_DATA_DIR):
+    if data_dir:
+        import dataset_io
+        return dataset_io.filings_per_month_from_files(data_dir)
+
+    cur = get_connection().cursor()
     
     cur.execute("""
-        SELECT substr(filing_date, 1, 7) AS ym,
-               COUNT(*)
-        FROM filings
+        SELECT substr(day, 1, 7) AS ym,
+               SUM(n)
+        FROM filings_daily
         GROUP BY ym
+        HAVING SUM(n) > 0
         ORDER BY ym
     """)
     
     rows = cur.fetchall()
-    conn.close()
 
     # Filter out any None/empty ym
     return [(ym, count) for ym, count in rows if ym]
 
-def plot_filings_over_time(ym_counts):
+def plot_filings_over_time(ym_counts, filename="fig2_filings_over_time.png"):
     if not ym_counts:
         print("No monthly filing data to plot.")
         return
@@ -157,100 +176,352 @@ def plot_filings_over_time(ym_counts):
         plt.text(i, v + 0.1, str(v), ha="center", va="bottom", fontsize=8)
 
     plt.tight_layout()
-    plt.savefig("fig2_filings_over_time.png", bbox_inches="tight")
-    plt.show()
+    plt.savefig(filename, bbox_inches="tight")
+    plt.close()
 
-# AVERAGE RETURNS FOR DAY0 to 5 and 5 to 10 
+# MEDIAN RETURNS PER EVENT WINDOW
 
-def load_compact_stock_returns():
-    conn = get_connection()
-    cur = conn.cursor()
+def load_event_returns(data_dir=ANALYSIS_DATA_DIR):
+    # Columnar load of the long-format event_returns table (trading-day windows only, legacy
+    # calendar-day rows are left out), NaN where a return is not numeric
+    if data_dir:
+        import dataset_io
+        return dataset_io.event_returns_from_files(data_dir)
+
+    cur = get_connection().cursor()
     
     cur.execute("""
-        SELECT c.ticker, r.filing_date, r.return_day0_to_day5, r.return_day5_to_day10
-        FROM stock_returns r
+        SELECT r.company_id,
+               CAST(julianday(r.filing_date) - 2440587.5 AS INTEGER),
+               r.window_start,
+               r.window_end,
+               CASE WHEN typeof(r.return_pct) IN ('real', 'integer') THEN r.return_pct END,
+               CASE WHEN typeof(r.abnormal_return_pct) IN ('real', 'integer') THEN r.abnormal_return_pct END
+        FROM event_returns r
         JOIN companies c ON r.company_id = c.id
+        WHERE r.calendar_days = 0
     """)
     
-    rows = cur.fetchall()
-    conn.close()
+    table = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 6)
 
-    results = []
-    for ticker, filing_date, r0_5, r5_10 in rows:
-    
-        try:
-            r0_5_val = float(r0_5) if r0_5 is not None else None
-    
-        except Exception:
-            r0_5_val = None
-    
-        try:
-            r5_10_val = float(r5_10) if r5_10 is not None else None
-    
-        except Exception:
-            r5_10_val = None
+    return {
+        "company_id": table[:, 0].astype(np.int64),
+        # -1 marks an unparseable filing date
+        "filing_day": np.nan_to_num(table[:, 1], nan=-1).astype(np.int32),
+        "window_start": table[:, 2].astype(np.int32),
+        "window_end": table[:, 3].astype(np.int32),
+        "return_pct": table[:, 4],
+        # Cumulative abnormal return vs the benchmark (market model)
+        "abnormal_return_pct": table[:, 5],
+    }
 
-        results.append((ticker, filing_date, r0_5_val, r5_10_val))
 
-    return results
+def _window_ids(cols):
+    # Dense id per distinct (start, end) window, ordered by start then end
+    windows, ids = np.unique(np.stack([cols["window_start"], cols["window_end"]], axis=1),
+                             axis=0, return_inverse=True)
+    return [window_label(tuple(int(x) for x in w)) for w in windows], ids.reshape(-1)
 
 
-def calculate_avg_returns():
-    rows = load_compact_stock_returns()
-    r0_5_list = []
-    r5_10_list = []
+# RETURN STATISTICS ENGINE
 
-    for _, _, r0_5, r5_10 in rows:
-    
-        if r0_5 is not None:
-            r0_5_list.append(r0_5)
-    
-        if r5_10 is not None:
-            r5_10_list.append(r5_10)
+def _group_quantile(sorted_values, starts, counts, q):
+    # Linear interpolation between order statistics, per contiguous group
+    pos = q * (counts - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    frac = pos - lo
+    return sorted_values[starts + lo] * (1 - frac) + sorted_values[starts + hi] * frac
+
+
+def grouped_return_stats(values, keys, trim=0.1, quantiles=(0.1, 0.25, 0.75, 0.9),
+                         n_boot=1000, ci=0.95, seed=0):
+    values = np.asarray(values, dtype=np.float64)
+    keys = np.asarray(keys)
+
+    keep = ~np.isnan(values)
+    values, keys = values[keep], keys[keep]
+
+    if len(values) == 0:
+        return {}
+
+    # Sort by (group, value) so every group is one contiguous, ascending run
+    group_keys, group_ids = np.unique(keys, return_inverse=True)
+    order = np.lexsort((values, group_ids))
+    v = values[order]
+    g = group_ids[order]
+
+    counts = np.bincount(g, minlength=len(group_keys))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    mean = np.bincount(g, weights=v) / counts
+    sum_sq = np.bincount(g, weights=v * v)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = np.where(counts > 1, (sum_sq - counts * mean ** 2) / (counts - 1), np.nan)
+        std_error = np.sqrt(np.maximum(var, 0)) / np.sqrt(counts)
+
+    # Trimmed mean from prefix sums over the sorted runs
+    cut = np.floor(trim * counts).astype(np.int64)
+    prefix = np.concatenate(([0.0], np.cumsum(v)))
+    trimmed_mean = (prefix[starts + counts - cut] - prefix[starts + cut]) / (counts - 2 * cut)
+
+    median = _group_quantile(v, starts, counts, 0.5)
+    qs = {q: _group_quantile(v, starts, counts, q) for q in quantiles}
+
+    # Bootstrap CI of the median. Each resample draws, for every observation slot, a random
+    # index from that slot's own group. Group index ranges don't overlap and are ordered, so
+    # one row-wise sort leaves every group's draws sorted in place, and the resampled
+    # medians can be read off with the same order-statistic arithmetic.
+    rng = np.random.default_rng(seed)
+    slot_start = starts[g]
+    slot_count = counts[g]
+    chunk = max(1, min(n_boot, 5_000_000 // len(v)))
+    boot = []
+
+    for done in range(0, n_boot, chunk):
+        b = min(chunk, n_boot - done)
+        draws = slot_start + (rng.random((b, len(v))) * slot_count).astype(np.int64)
+        draws.sort(axis=1)
+        pos = 0.5 * (counts - 1)
+        lo = starts + np.floor(pos).astype(np.int64)
+        hi = starts + np.ceil(pos).astype(np.int64)
+        frac = pos - np.floor(pos)
+        boot.append(v[draws[:, lo]] * (1 - frac) + v[draws[:, hi]] * frac)
+
+    boot = np.concatenate(boot, axis=0)
+    alpha = (1 - ci) / 2
+    ci_low, ci_high = np.quantile(boot, [alpha, 1 - alpha], axis=0)
+
+    stats = {
+        "n": counts,
+        "mean": mean,
+        "median": median,
+        "trimmed_mean": trimmed_mean,
+        "std_error": std_error,
+        "median_ci_low": ci_low,
+        "median_ci_high": ci_high,
+    }
 
-    avg0_5 = median(r0_5_list) if r0_5_list else None
-    avg5_10 = median(r5_10_list) if r5_10_list else None
+    for q, arr in qs.items():
+        stats[f"q{round(q * 100):02d}"] = arr
 
     return {
-        "avg_day0_5": avg0_5,
-        "avg_day5_10": avg5_10,
-        "count_day0_5": len(r0_5_list),
-        "count_day5_10": len(r5_10_list)
+        key.item() if hasattr(key, "item") else key: {name: arr[i].item() for name, arr in stats.items()}
+        for i, key in enumerate(group_keys)
     }
 
-def plot_avg_returns_bar(avg_stats):
-    avg0 = avg_stats.get("avg_day0_5")
-    avg5 = avg_stats.get("avg_day5_10")
 
-    labels = ["Day0 → Day5", "Day5 → Day10"]
-    values = [avg0 if avg0 is not None else 0.0, avg5 if avg5 is not None else 0.0]
+def calculate_return_stats_by(group="rate_bucket", thresholds=RATE_BUCKET_THRESHOLDS, measure="return_pct",
+                              data_dir=ANALYSIS_DATA_DIR):
+    # group: "month" (filing YYYY-MM) or "rate_bucket" (10Y yield at filing);
+    # measure: "return_pct" (raw) or "abnormal_return_pct" (CAR);
+    # returns {window label: {group: stats}} from one grouped pass over (window, group)
+    cols = load_event_returns(data_dir)
+    days = cols["filing_day"]
+    valid = days >= 0
+
+    if group == "month":
+        keys = days[valid].astype("datetime64[D]").astype("datetime64[M]").astype(str)
+
+    elif group == "rate_bucket":
+        rate_days, rate_values = load_interest_rates(data_dir=data_dir)
+        rates = asof_join(days[valid], rate_days, rate_values)
+        thresholds = sorted(thresholds)
+        labels = np.array(rate_bucket_labels(thresholds) + ["No rate"])
+        bucket = np.searchsorted(thresholds, rates, side="right")
+        bucket[np.isnan(rates)] = len(labels) - 1
+        keys = labels[bucket]
+
+    else:
+        raise ValueError(f"Unknown grouping: {group}")
+
+    window_labels, window_ids = _window_ids(cols)
+    group_names, group_ids = np.unique(keys, return_inverse=True)
+    combined = window_ids[valid] * len(group_names) + group_ids.reshape(-1)
+
+    result = {label: {} for label in window_labels}
+
+    for key, stats in grouped_return_stats(cols[measure][valid], combined).items():
+        result[window_labels[key // len(group_names)]][group_names[key % len(group_names)].item()] = stats
+
+    return result
+
+
+def histogram_return_stats(bins, counts, width, total, total_sq, trim=0.1, quantiles=(0.1, 0.25, 0.75, 0.9),
+                           ci=0.95):
+    # Same keys as grouped_return_stats, from one window's histogram sketch (ascending bins).
+    # n, mean and std_error are exact; order statistics are bin centres (within width / 2);
+    # the median CI is the distribution-free order-statistic interval instead of a bootstrap.
+    centres = np.asarray(bins, dtype=np.float64) * width
+    counts = np.asarray(counts, dtype=np.int64)
+    n = int(counts.sum())
+
+    if n == 0:
+        return None
+
+    upper = np.cumsum(counts)
+    lower = upper - counts
+
+    def at_rank(rank):
+        return centres[np.searchsorted(upper, rank, side="right")]
+
+    def quantile(q):
+        pos = q * (n - 1)
+        frac = pos - np.floor(pos)
+        return float(at_rank(int(np.floor(pos))) * (1 - frac) + at_rank(int(np.ceil(pos))) * frac)
+
+    mean = total / n
+    var = (total_sq - n * mean ** 2) / (n - 1) if n > 1 else np.nan
+
+    cut = int(np.floor(trim * n))
+    kept = np.clip(np.minimum(upper, n - cut) - np.maximum(lower, cut), 0, None)
+
+    z = NormalDist().inv_cdf((1 + ci) / 2)
+    half = z * np.sqrt(n) / 2
+    lo_rank = int(np.clip(np.floor(n / 2 - half), 0, n - 1))
+    hi_rank = int(np.clip(np.ceil(n / 2 + half), 0, n - 1))
+
+    stats = {
+        "n": n,
+        "mean": float(mean),
+        "median": quantile(0.5),
+        "trimmed_mean": float((centres * kept).sum() / (n - 2 * cut)),
+        "std_error": float(np.sqrt(max(var, 0)) / np.sqrt(n)) if n > 1 else float("nan"),
+        "median_ci_low": float(at_rank(lo_rank)),
+        "median_ci_high": float(at_rank(hi_rank)),
+    }
+
+    for q in quantiles:
+        stats[f"q{round(q * 100):02d}"] = quantile(q)
+
+    return stats
+
+
+def materialized_avg_returns(measure="return_pct"):
+    # calculate_avg_returns from return_histogram / return_window_totals: cost scales with
+    # the number of occupied bins, not the number of event rows
+    cur = get_connection().cursor()
+    cur.execute("""
+        SELECT window_start, window_end, n, total, total_sq
+        FROM return_window_totals
+        WHERE measure = ? AND n > 0
+        ORDER BY window_start, window_end
+    """, (measure,))
+    totals = cur.fetchall()
+
+    cur.execute("""
+        SELECT window_start, window_end, bin, n
+        FROM return_histogram
+        WHERE measure = ? AND n > 0
+        ORDER BY window_start, window_end, bin
+    """, (measure,))
+    hist = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 4)
+
+    result = {}
+
+    for start, end, n, total, total_sq in totals:
+        rows = hist[(hist[:, 0] == start) & (hist[:, 1] == end)]
+        stats = histogram_return_stats(rows[:, 2], rows[:, 3], RETURN_HISTOGRAM_BIN_WIDTH, total, total_sq)
+
+        if stats:
+            result[window_label((start, end))] = stats
+
+    return result
+
+
+def calculate_avg_returns(measure="return_pct", data_dir=ANALYSIS_DATA_DIR):
+    # {window label: stats}, e.g. {"Day0 → Day5": {"median": ..., "n": ...}}
+    if not data_dir:
+        return materialized_avg_returns(measure)
+
+    cols = load_event_returns(data_dir)
+    window_labels, window_ids = _window_ids(cols)
+    stats = grouped_return_stats(cols[measure], window_ids)
+    return {window_labels[i]: stats[i] for i in sorted(stats)}
+
+def plot_avg_returns_bar(avg_stats, filename="fig3_avg_returns_bar.png"):
+    labels = list(avg_stats.keys())
+    values = [avg_stats[w]["median"] for w in labels]
 
     plt.figure(figsize=(10, 5), dpi=140)
     bars = plt.bar(labels, values)
-    plt.title("Median Returns Around Primary Follow-On Announcement")
+    plt.title("Median Returns Around Primary Follow-On Announcement (trading-day windows)")
     plt.ylabel("Median Return (%)")
 
-    # Annotate bars with values or 'N/A'
-    for i, b in enumerate(bars):
-        val = values[i]
-        
-        if (i == 0 and avg0 is None) or (i == 1 and avg5 is None):
-            txt = "N/A"
-        
-        else:
-            txt = f"{val:.2f}%"
-        
-        plt.text(b.get_x() + b.get_width() / 2, b.get_height() + 0.05, txt,
+    if not labels:
+        plt.text(0.5, 0.5, "N/A", ha="center", va="center", transform=plt.gca().transAxes)
+
+    # Annotate bars with values and sample sizes
+    for b, w in zip(bars, labels):
+        txt = f"{avg_stats[w]['median']:.2f}%\n(n={avg_stats[w]['n']})"
+        plt.text(b.get_x() + b.get_width() / 2, max(b.get_height(), 0) + 0.05, txt,
                  ha="center", va="bottom", fontsize=9)
 
     plt.tight_layout()
-    plt.savefig("fig3_avg_returns_bar.png", bbox_inches="tight")
-    plt.show()
+    plt.savefig(filename, bbox_inches="tight")
+    plt.close()
+
+
+# FIGURE RENDERING (process pool, skipped when the PNG is already current)
+
+def figure_hash(plot_func, data):
+    # Input data plus the plotting code itself, so edits to a plot also re-render it
+    code = plot_func.__code__
+    payload = json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+    digest = hashlib.sha256(payload)
+    digest.update(code.co_code)
+    digest.update(repr(code.co_consts).encode("utf-8"))
+    return digest.hexdigest()
+
+
+@timed()
+def render_figures(jobs, max_workers=FIGURE_WORKERS, force=False, cache=True):
+    # jobs are (plot_func, data, filename); returns the filenames actually rendered.
+    # cache=False renders everything without touching the metadata table (no database needed)
+    todo = []
+
+    for plot_func, data, filename in jobs:
+        digest = figure_hash(plot_func, data)
+
+        if cache and not force and os.path.exists(filename) and get_metadata(f"figure_hash:{filename}") == digest:
+            print(f"{filename} is up to date, skipping.")
+            continue
+
+        todo.append((plot_func, data, filename, digest))
+
+    if not todo:
+        return []
+
+    workers = min(max_workers, len(todo), os.cpu_count() or 1)
+
+    # Spawned (not forked) workers: this can run on a scheduler thread with open SQLite/HTTP state
+    if workers > 1 and len(todo) >= FIGURE_POOL_MIN_FIGURES:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [(pool.submit(plot_func, data, filename), filename, digest)
+                       for plot_func, data, filename, digest in todo]
+
+            for future, filename, digest in futures:
+                future.result()
+
+                if cache:
+                    set_metadata(f"figure_hash:{filename}", digest)
+
+    else:
+        for plot_func, data, filename, digest in todo:
+            plot_func(data, filename)
+
+            if cache:
+                set_metadata(f"figure_hash:{filename}", digest)
+
+    return [filename for _, _, filename, _ in todo]
 
 
 # SUMMARY OUTPUT TO TEXT FILE
 
-def write_summary_to_file(bucket_counts, avg_stats, ym_counts, filename="analysis_summary.txt"):
+def write_summary_to_file(bucket_counts, avg_stats, ym_counts, bucket_return_stats=None, abnormal_stats=None,
+                          filename="analysis_summary.txt", exact_stats=True):
+    # exact_stats=False: avg / abnormal stats came from the materialized return histograms
     # Helper to normalize labels, def inside def
     
     def normalize_label(s: str) -> str:
@@ -283,23 +554,16 @@ def write_summary_to_file(bucket_counts, avg_stats, ym_counts, filename="analysi
         f.write("2) Median Returns Around Primary Follow-On Filings\n")
         
         if avg_stats:
-            a0 = avg_stats.get("avg_day0_5")
-            a5 = avg_stats.get("avg_day5_10")
-            c0 = avg_stats.get("count_day0_5", 0)
-            c5 = avg_stats.get("count_day5_10", 0)
-        
-            if a0 is not None:
-                f.write(f"   - Day0 → Day5: {a0:.2f}% (n={c0})\n")
-        
-            else:
-                f.write(f"   - Day0 → Day5: N/A (n={c0})\n")
-        
-            if a5 is not None:
-                f.write(f"   - Day5 → Day10: {a5:.2f}% (n={c5})\n")
-        
+            if exact_stats:
+                f.write("   (exact medians over all event returns)\n")
+
             else:
-                f.write(f"   - Day5 → Day10: N/A (n={c5})\n")
-        
+                f.write(f"   (medians from the materialized return histograms, within "
+                        f"{RETURN_HISTOGRAM_BIN_WIDTH / 2:g} pct-points of the exact value)\n")
+
+            for window, st in avg_stats.items():
+                f.write(f"   - {window}: {st['median']:.2f}% (n={st['n']})\n")
+
             f.write("\n")
         
         else:
@@ -317,24 +581,63 @@ def write_summary_to_file(bucket_counts, avg_stats, ym_counts, filename="analysi
         else:
             f.write("   No filings aggregated by month.\n\n")
 
+        # Return statistics by rate environment
+        if bucket_return_stats:
+            f.write("4) Median Returns by 10Y Treasury Yield Environment (95% bootstrap CI)\n")
+
+            for window, by_bucket in bucket_return_stats.items():
+                for bucket, st in by_bucket.items():
+                    f.write(f"   - {window}, {normalize_label(bucket)}: {st['median']:.2f}% "
+                            f"[{st['median_ci_low']:.2f}%, {st['median_ci_high']:.2f}%] (n={st['n']})\n")
+
+            f.write("\n")
+
+        # Benchmark-adjusted returns
+        if abnormal_stats:
+            f.write(f"5) Median Cumulative Abnormal Returns (market model vs {BENCHMARK_TICKER}, "
+                    f"95% {'bootstrap' if exact_stats else 'order-statistic'} CI)\n")
+
+            for window, st in abnormal_stats.items():
+                f.write(f"   - {window}: {st['median']:.2f}% "
+                        f"[{st['median_ci_low']:.2f}%, {st['median_ci_high']:.2f}%] (n={st['n']})\n")
+
+            f.write("\n")
+
     print(f"Summary written to {filename}")
 
 # RUN
-def run_analysis():
+@timed()
+def run_analysis(force_figures=False, data_dir=ANALYSIS_DATA_DIR, by_rate_bucket=ANALYSIS_BY_RATE_BUCKET):
+    # data_dir: read an export written by dataset_io.export_dataset instead of SQLite
+    # by_rate_bucket: also compute return stats per rate bucket (full event_returns scan)
+
     # Filings by rate bucket (bar chart)
-    bucket_counts = calculate_filings_by_rate_bucket()
+    bucket_counts = calculate_filings_by_rate_bucket(data_dir=data_dir)
     print("Filings by rate bucket:", bucket_counts)
-    plot_filings_by_rate_bucket(bucket_counts)
 
-    # Average returns (two-bar chart)
-    avg_stats = calculate_avg_returns()
-    print("Average return stats:", avg_stats)
-    plot_avg_returns_bar(avg_stats)
+    # Median returns per event window (bar chart)
+    avg_stats = calculate_avg_returns(data_dir=data_dir)
+    print("Median return stats by window:", {w: round(st["median"], 2) for w, st in avg_stats.items()})
 
     # Filings per month (line chart)
-    ym_counts = calculate_filings_per_month()
+    ym_counts = calculate_filings_per_month(data_dir)
     print("Filings per month:", ym_counts)
-    plot_filings_over_time(ym_counts)
+
+    render_figures([
+        (plot_filings_by_rate_bucket, bucket_counts, "fig1_filings_by_rate_bucket.png"),
+        (plot_avg_returns_bar, avg_stats, "fig3_avg_returns_bar.png"),
+        (plot_filings_over_time, ym_counts, "fig2_filings_over_time.png"),
+    ], force=force_figures, cache=not data_dir)
+
+    # Return statistics grouped by rate environment
+    bucket_return_stats = calculate_return_stats_by("rate_bucket", data_dir=data_dir) if by_rate_bucket else None
+
+    # Benchmark-adjusted (CAR) medians per window
+    abnormal_stats = calculate_avg_returns(measure="abnormal_return_pct", data_dir=data_dir)
+
+    if abnormal_stats:
+        print("Median CAR by window:", {w: round(st["median"], 2) for w, st in abnormal_stats.items()})
 
     # Write summary file
-    write_summary_to_file(bucket_counts, avg_stats, ym_counts)
\ No newline at end of file
+    write_summary_to_file(bucket_counts, avg_stats, ym_counts, bucket_return_stats, abnormal_stats,
+                          exact_stats=bool(data_dir))
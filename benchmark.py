@@ -0,0 +1,337 @@
+import argparse
+import json
+import math
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Offline benchmark: local stand-ins for the SEC, StockData and FRED APIs serve deterministic
+# synthetic data, and every scale runs the real pipeline/analysis code in its own subprocess
+# (fresh database, fresh config) so results are comparable across commits:
+#
+#   python benchmark.py --scales 1000,10000,100000 --out benchmark_results.json
+
+DEFAULT_SCALES = "1000,10000,100000"
+DEFAULT_YEARS = 5
+DEFAULT_MAX_COMPANIES = 1000
+FILINGS_PER_COMPANY = 10
+
+
+# SYNTHETIC DATA (a pure function of scale + index, so pages can be served without materializing them)
+
+def companies_for_scale(scale: int, max_companies: int) -> int:
+    return max(1, min(max_companies, scale // FILINGS_PER_COMPANY))
+
+
+def month_count(years: int) -> int:
+    return years * 12 + 1
+
+
+def synthetic_filing(month: str, i: int, per_month: int, companies: int) -> dict:
+    # Filings of a month are indexed newest first (the real API sorts filedAt desc)
+    year, mon = int(month[:4]), int(month[5:7])
+    day = 28 - (i * 28) // max(1, per_month)
+    company = (year * 12 + mon) * 7919 + i * 104729
+    company %= companies
+
+    return {
+        "cik": str(100000 + company),
+        "companyName": f"SYNTHETIC  HOLDINGS {company}",
+        "ticker": f"BM{company}",
+        "filedAt": f"{month}-{max(day, 1):02d}T16:05:00-04:00",
+        "formType": "8-K",
+        "linkToHtml": f"https://bench.local/{month}/{i}",
+    }
+
+
+def synthetic_close(ticker: str, day: date) -> float:
+    seed = zlib.crc32(ticker.encode("utf-8")) % 1000
+    t = day.toordinal()
+    return round(20 + seed / 50 + 3 * math.sin(t / 17 + seed) + 0.01 * (t % 365), 4)
+
+
+def synthetic_rate(series_id: str, day: date) -> float:
+    seed = zlib.crc32(series_id.encode("utf-8")) % 100
+    return round(2.5 + 2 * math.sin(day.toordinal() / 300 + seed), 2)
+
+
+def business_days(date_from: str, date_to: str):
+    d, end = date.fromisoformat(date_from[:10]), date.fromisoformat(date_to[:10])
+
+    while d <= end:
+        if d.weekday() < 5:
+            yield d
+        d += timedelta(days=1)
+
+
+# FAKE API SERVERS
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    # Routes: POST /sec/<scale>/<companies>/<months>, GET /stock/data/eod, GET /fred/series/observations
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        if parts[0] != "sec" or len(parts) != 4:
+            self.send_error(404)
+            return
+
+        scale, companies, months = (int(p) for p in parts[1:])
+        per_month = math.ceil(scale / months)
+        offset, size = int(payload.get("from", 0)), int(payload.get("size", 50))
+
+        m = re.search(r"filedAt:\[(\S+) TO (\S+)\]", payload.get("query", ""))
+        month = m.group(1)[:7] if m else date.today().isoformat()[:7]
+
+        filings = [synthetic_filing(month, i, per_month, companies)
+                   for i in range(offset, min(offset + size, per_month))]
+        self._send_json({"total": {"value": per_month}, "filings": filings})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path.endswith("/data/eod"):
+            data = [
+                {"ticker": symbol, "date": d.isoformat() + "T00:00:00.000Z",
+                 "open": close, "high": close, "low": close, "close": close, "volume": 1000}
+                for symbol in q["symbols"].split(",")
+                for d in business_days(q["date_from"], q["date_to"])
+                for close in (synthetic_close(symbol, d),)
+            ]
+            self._send_json({"data": data})
+
+        elif url.path.endswith("/series/observations"):
+            series_id = q["series_id"]
+            self._send_json({"observations": [
+                {"date": d.isoformat(), "value": str(synthetic_rate(series_id, d))}
+                for d in business_days(q["observation_start"], q.get("observation_end", date.today().isoformat()))
+            ]})
+
+        else:
+            self.send_error(404)
+
+
+def start_fake_apis():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+# ONE SCALE (runs in a child process whose environment points config.py at the fakes)
+
+def measure(results: dict, name: str, func, track_memory: bool, rows=None):
+    from instrumentation import stage
+
+    if track_memory:
+        tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+
+    with stage(f"bench:{name}"):
+        value = func()
+
+    elapsed = time.perf_counter() - start
+    n = rows(value) if rows else None
+
+    results[name] = {
+        "seconds": round(elapsed, 4),
+        "rows": n,
+        "rows_per_second": round(n / elapsed, 1) if n and elapsed > 0 else None,
+        "peak_traced_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2) if track_memory else None,
+    }
+    print(f"  {name}: {elapsed:.2f}s" + (f", {n} rows" if n is not None else ""))
+    return value
+
+
+def run_scale(scale: int, track_memory: bool, all_filings: bool) -> dict:
+    # Imported here: config.py reads the benchmark environment set up by the parent
+    from db import create_tables, get_connection
+    from pipeline import load_sec_backfill, load_and_store_stock_returns, load_interest_rate_data
+    from analysis import (
+        calculate_filings_by_rate_bucket, calculate_filings_per_month, calculate_avg_returns,
+        calculate_return_stats_by, render_figures,
+        plot_filings_by_rate_bucket, plot_filings_over_time, plot_avg_returns_bar
+    )
+    from instrumentation import run_report
+
+    def table_rows(table):
+        return lambda _: get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    if track_memory:
+        tracemalloc.start()
+
+    stages = {}
+    create_tables()
+
+    measure(stages, "sec_ingest", load_sec_backfill, track_memory, table_rows("filings"))
+    measure(stages, "rate_ingest", load_interest_rate_data, track_memory, table_rows("rates_daily"))
+    measure(stages, "return_computation", lambda: load_and_store_stock_returns(all_filings=all_filings),
+            track_memory, table_rows("event_returns"))
+
+    filings = table_rows("filings")(None)
+    buckets = measure(stages, "rate_bucketing", calculate_filings_by_rate_bucket, track_memory, lambda _: filings)
+    months = measure(stages, "monthly_aggregation", calculate_filings_per_month, track_memory, lambda _: filings)
+    avg_stats = measure(stages, "return_stats", calculate_avg_returns, track_memory, table_rows("event_returns"))
+    measure(stages, "return_stats_by_rate_bucket", lambda: calculate_return_stats_by("rate_bucket"),
+            track_memory, table_rows("event_returns"))
+    measure(stages, "figure_rendering", lambda: render_figures([
+        (plot_filings_by_rate_bucket, buckets, "fig1_filings_by_rate_bucket.png"),
+        (plot_avg_returns_bar, avg_stats, "fig3_avg_returns_bar.png"),
+        (plot_filings_over_time, months, "fig2_filings_over_time.png"),
+    ], force=True), track_memory, len)
+
+    return {
+        "scale": scale,
+        "filings": filings,
+        "stages": stages,
+        "total_seconds": round(sum(s["seconds"] for s in stages.values()), 4),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "instrumentation": run_report(),
+    }
+
+
+def scale_environment(base_url: str, scale: int, companies: int, years: int, workdir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DB_NAME": os.path.join(workdir, "benchmark.db"),
+        "SEC_BASE_URL": f"{base_url}/sec/{scale}/{companies}/{month_count(years)}",
+        "STOCKDATA_BASE_URL": f"{base_url}/stock",
+        "FRED_BASE_URL": f"{base_url}/fred",
+        "SEC_API_KEY": "benchmark",
+        "STOCKDATA_API_KEY": "benchmark",
+        "FRED_API_KEY": "benchmark",
+        "SEC_BACKFILL_YEARS": str(years),
+        "SEC_PAGE_SIZE": env.get("SEC_PAGE_SIZE", "500"),
+        "FRED_START_YEARS_BACK": str(years + 1),
+        "STOCKDATA_REQUESTS_PER_SECOND": "0",
+        "HTTP_CACHE_ENABLED": "0",
+        "HTTP_CACHE_OFFLINE": "0",
+        "RUN_REPORT_PATH": os.path.join(workdir, "run_report.json"),
+        "PROFILE_STAGES": "0",
+    })
+    return env
+
+
+# SANITY CHECKS (run before any scale, no servers needed)
+
+def check_price_batching():
+    # Long, overlapping event ranges (the default jobs span months) must still share requests
+    from stock_api import group_price_requests
+
+    identical = group_price_requests([(f"T{i}", "2024-01-01", "2024-10-01") for i in range(10)])
+    shifted = group_price_requests([(f"T{i}", f"2024-01-{1 + 3 * i:02d}", f"2024-10-{1 + 3 * i:02d}")
+                                    for i in range(10)])
+    assert len(identical) == 1 and len(shifted) == 1, f"long ranges not batched: {identical} / {shifted}"
+
+
+# DRIVER
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline pipeline/analysis benchmark against synthetic APIs.")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma-separated filing counts, e.g. 1000,1000000")
+    parser.add_argument("--years", type=int, default=DEFAULT_YEARS, help="years of filings (monthly backfill slices)")
+    parser.add_argument("--max-companies", type=int, default=DEFAULT_MAX_COMPANIES,
+                        help="cap on distinct issuers (each one is a price fetch)")
+    parser.add_argument("--all-filings", action="store_true", help="compute returns for every filing")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (faster, no peak_traced_mb)")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--run-scale", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+
+    except OSError:
+        return None
+
+
+def main():
+    args = parse_args()
+
+    if args.run_scale:
+        result = run_scale(args.run_scale, not args.no_memory, args.all_filings)
+
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f, default=str)
+
+        return
+
+    check_price_batching()
+    server, base_url = start_fake_apis()
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+
+    for scale in (int(s) for s in args.scales.split(",")):
+        companies = companies_for_scale(scale, args.max_companies)
+        print(f"Scale {scale} filings ({companies} companies, {args.years} years)...")
+
+        with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+            result_file = os.path.join(workdir, "result.json")
+            cmd = [sys.executable, os.path.join(here, "benchmark.py"), "--run-scale", str(scale),
+                   "--result-file", result_file]
+            cmd += ["--no-memory"] if args.no_memory else []
+            cmd += ["--all-filings"] if args.all_filings else []
+
+            env = scale_environment(base_url, scale, companies, args.years, workdir)
+            env["PYTHONPATH"] = here + os.pathsep + env.get("PYTHONPATH", "")
+
+            subprocess.run(cmd, env=env, cwd=workdir, check=True,
+                           stdout=None if os.environ.get("BENCHMARK_VERBOSE") == "1" else subprocess.DEVNULL)
+
+            with open(result_file, encoding="utf-8") as f:
+                result = json.load(f)
+
+        result["companies"] = companies
+        results.append(result)
+
+        for name, s in result["stages"].items():
+            print(f"  {name}: {s['seconds']:.3f}s" + (f", {s['rows_per_second']:g} rows/s" if s["rows_per_second"] else "")
+                  + (f", peak {s['peak_traced_mb']} MB" if s["peak_traced_mb"] is not None else ""))
+
+    server.shutdown()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "years": args.years,
+            "all_filings": args.all_filings,
+            "results": results,
+        }, f, indent=2, default=str)
+
+    print(f"Benchmark results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
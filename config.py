@@ -1,12 +1,110 @@
 import os
 
-DB_NAME = "asset_classes.db"
+DB_NAME = os.environ.get("DB_NAME", "asset_classes.db")
+
+# SQLITE TUNING (see db.get_connection)
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", "-65536"))        # negative = KiB, so 64 MB
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+DB_EXPLAIN_QUERIES = os.environ.get("DB_EXPLAIN_QUERIES", "0") == "1"   # dump EXPLAIN QUERY PLAN per query
 
 # DO NOT REMOVE ENVIRONMENT VARIABLES :D
 SEC_API_KEY = os.environ.get("SEC_API_KEY", "INSERT HERE")
 STOCKDATA_API_KEY = os.environ.get("STOCKDATA_API_KEY", "INSERT HERE")
 FRED_API_KEY = os.environ.get("FRED_API_KEY", "INSERT HERE")
 
-SEC_BASE_URL = "https://api.sec-api.io"
-STOCKDATA_BASE_URL = "https://api.stockdata.org/v1"   #https://www.stockdata.org/
-FRED_BASE_URL = "https://api.stlouisfed.org/fred"
+SEC_BASE_URL = os.environ.get("SEC_BASE_URL", "https://api.sec-api.io")
+STOCKDATA_BASE_URL = os.environ.get("STOCKDATA_BASE_URL", "https://api.stockdata.org/v1")   #https://www.stockdata.org/
+FRED_BASE_URL = os.environ.get("FRED_BASE_URL", "https://api.stlouisfed.org/fred")
+
+# HTTP CLIENT (shared by every API module, see http_client.py)
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "60"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_SECONDS = float(os.environ.get("HTTP_BACKOFF_SECONDS", "1.0"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "16"))
+
+# HTTP RESPONSE CACHE (see http_cache.py): successful responses stored on disk, keyed on
+# method/URL/params/payload without API keys; offline mode serves only from the cache
+HTTP_CACHE_ENABLED = os.environ.get("HTTP_CACHE_ENABLED", "0") == "1"
+HTTP_CACHE_OFFLINE = os.environ.get("HTTP_CACHE_OFFLINE", "0") == "1"
+HTTP_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", ".http_cache")
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("HTTP_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Seconds per source; 0 never expires
+HTTP_CACHE_TTLS = {
+    source: float(ttl) for source, ttl in
+    (item.split(":") for item in os.environ.get("HTTP_CACHE_TTLS", "sec:3600,stockdata:86400,fred:43200").split(","))
+}
+
+# STOCKDATA FETCH ENGINE (concurrency + quota)
+STOCKDATA_MAX_WORKERS = int(os.environ.get("STOCKDATA_MAX_WORKERS", "8"))
+STOCKDATA_REQUESTS_PER_SECOND = float(os.environ.get("STOCKDATA_REQUESTS_PER_SECOND", "5"))
+STOCKDATA_BURST = int(os.environ.get("STOCKDATA_BURST", "5"))
+STOCKDATA_MAX_RETRIES = int(os.environ.get("STOCKDATA_MAX_RETRIES", "4"))
+STOCKDATA_BACKOFF_SECONDS = float(os.environ.get("STOCKDATA_BACKOFF_SECONDS", "1.0"))
+STOCKDATA_MAX_SYMBOLS_PER_REQUEST = int(os.environ.get("STOCKDATA_MAX_SYMBOLS_PER_REQUEST", "20"))
+STOCKDATA_MAX_BATCH_DAYS = int(os.environ.get("STOCKDATA_MAX_BATCH_DAYS", "45"))   # max days a batch adds to any symbol's range
+
+# EVENT STUDY: trading-day windows [start, end] relative to the first trading day on/after the filing
+EVENT_WINDOWS = [
+    tuple(int(x) for x in w.split(":"))
+    for w in os.environ.get("EVENT_WINDOWS", "-5:0,0:1,0:5,5:10,0:20,0:60").split(",")
+]
+
+# Study every filing (not just each company's first); filings within EVENT_DEDUP_DAYS
+# calendar days of a kept event of the same company count as that event
+EVENT_ALL_FILINGS = os.environ.get("EVENT_ALL_FILINGS", "0") == "1"
+EVENT_DEDUP_DAYS = int(os.environ.get("EVENT_DEDUP_DAYS", "7"))
+
+# Market-model abnormal returns (opt-in: fetches the benchmark and stretches every price job back
+# over the estimation window): benchmark series and the pre-event estimation window (trading days)
+ABNORMAL_RETURNS = os.environ.get("ABNORMAL_RETURNS", "0") == "1"
+BENCHMARK_TICKER = os.environ.get("BENCHMARK_TICKER", "SPY")
+ESTIMATION_WINDOW = tuple(int(x) for x in os.environ.get("ESTIMATION_WINDOW", "-130:-11").split(":"))
+MIN_ESTIMATION_DAYS = int(os.environ.get("MIN_ESTIMATION_DAYS", "60"))
+
+# Sharded return computation (see return_shards.py): companies are split across this many
+# processes once all prices are cached (1: in-process, companies laid out in batches as their prices arrive)
+RETURN_WORKERS = int(os.environ.get("RETURN_WORKERS", "1"))
+RETURN_SHARDS_PER_WORKER = int(os.environ.get("RETURN_SHARDS_PER_WORKER", "4"))   # smaller shards balance better
+# In-process: companies whose prices have arrived are loaded into one panel per this many
+RETURN_PANEL_COMPANIES = int(os.environ.get("RETURN_PANEL_COMPANIES", "256"))
+
+# FRED SERIES: 2Y/10Y Treasury, fed funds, VIX, IG and HY option-adjusted credit spreads
+FRED_SERIES_IDS = os.environ.get("FRED_SERIES_IDS", "DGS2,DGS10,FEDFUNDS,VIXCLS,BAMLC0A0CM,BAMLH0A0HYM2").split(",")
+FRED_START_YEARS_BACK = int(os.environ.get("FRED_START_YEARS_BACK", "5"))
+
+# SEC BACKFILL
+SEC_PAGE_SIZE = int(os.environ.get("SEC_PAGE_SIZE", "50"))
+SEC_MAX_WORKERS = int(os.environ.get("SEC_MAX_WORKERS", "4"))
+SEC_BACKFILL_YEARS = int(os.environ.get("SEC_BACKFILL_YEARS", "5"))
+SEC_WRITE_BATCH_SIZE = int(os.environ.get("SEC_WRITE_BATCH_SIZE", "500"))   # filings per committed write
+
+# ANALYSIS
+# 10Y yield cut points (%) for the rate-environment buckets, e.g. "2,4" -> <2, 2-4, >=4
+RATE_BUCKET_THRESHOLDS = [float(x) for x in os.environ.get("RATE_BUCKET_THRESHOLDS", "2,4").split(",")]
+FIGURE_WORKERS = int(os.environ.get("FIGURE_WORKERS", "3"))
+# Spawning a worker costs about as much as rendering a figure, so fewer are rendered inline
+FIGURE_POOL_MIN_FIGURES = int(os.environ.get("FIGURE_POOL_MIN_FIGURES", "8"))
+# Return stats per rate bucket scan every event row (and bootstrap), so they are opt-in
+ANALYSIS_BY_RATE_BUCKET = os.environ.get("ANALYSIS_BY_RATE_BUCKET", "0") == "1"
+
+# STAGE SCHEDULER (see scheduler.py): stages run as a dependency DAG; a stage whose last
+# successful run is younger than its max age (and than its dependencies' runs) is skipped
+STAGE_WORKERS = int(os.environ.get("STAGE_WORKERS", "3"))
+STAGE_MAX_AGE_HOURS = {
+    name: float(hours) for name, hours in
+    (item.split("=") for item in os.environ.get("STAGE_MAX_AGE_HOURS", "sec=6,fred=12,returns=24,analysis=24").split(","))
+}
+
+# INSTRUMENTATION (see instrumentation.py): JSON run report, optional cProfile dump per stage
+RUN_REPORT_PATH = os.environ.get("RUN_REPORT_PATH", "run_report.json")
+PROFILE_STAGES = os.environ.get("PROFILE_STAGES", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# EXPORT / FILE-BACKED ANALYSIS (pyarrow; see dataset_io.py)
+EXPORT_FORMAT = os.environ.get("EXPORT_FORMAT", "parquet")            # parquet (partitioned by year/month) or arrow
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", "100000"))
+ANALYSIS_DATA_DIR = os.environ.get("ANALYSIS_DATA_DIR") or None       # run the analysis off an export instead of SQLite
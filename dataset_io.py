@@ -0,0 +1,250 @@
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+from config import EXPORT_FORMAT, EXPORT_BATCH_ROWS
+from db import get_connection, transaction, create_tables, get_metadata, SCHEMA_VERSION_KEY
+
+# Table -> date column used for year/month partitioning (None: written unpartitioned)
+EXPORT_TABLES = {
+    "companies": None,
+    "filings": "filing_date",
+    "stock_returns": "filing_date",
+    "event_returns": "filing_date",
+    "stock_prices": "date",
+    "price_coverage": None,
+    "interest_rates": None,
+    "rate_observations": None,
+    "rates_daily": None,
+}
+
+PARTITION_COLUMNS = ("year", "month")
+MANIFEST_FILE = "_manifest.json"
+FORMATS = ("parquet", "arrow")
+
+
+def _pyarrow():
+    # Optional dependency, only needed for export/import and file-backed analysis
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.parquet
+
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet/Arrow export (pip install pyarrow)") from e
+
+    return pyarrow
+
+
+# EXPORT (SQLite -> Parquet dataset per table, or one Arrow IPC file per table)
+
+def _table_schema(table: str, partition_column: Optional[str]):
+    pa = _pyarrow()
+    cur = get_connection().cursor()
+    cur.execute(f"PRAGMA table_info({table})")
+
+    fields, selects = [], []
+
+    for _, name, declared, _, _, _ in cur.fetchall():
+        declared = (declared or "").upper()
+
+        # SQLite is dynamically typed: anything that isn't a number in a numeric column is exported as null
+        if "INT" in declared:
+            fields.append(pa.field(name, pa.int64()))
+            selects.append(f"CASE WHEN typeof({name}) = 'integer' THEN {name} END")
+
+        elif "REAL" in declared:
+            fields.append(pa.field(name, pa.float64()))
+            selects.append(f"CASE WHEN typeof({name}) IN ('real', 'integer') THEN {name} END")
+
+        else:
+            fields.append(pa.field(name, pa.string()))
+            selects.append(f"CAST({name} AS TEXT)")
+
+    if partition_column:
+        fields += [pa.field(p, pa.string()) for p in PARTITION_COLUMNS]
+        selects += [f"substr({partition_column}, 1, 4)", f"substr({partition_column}, 6, 2)"]
+
+    return pa.schema(fields), selects
+
+
+def _record_batches(table: str, schema, selects, batch_rows: int):
+    pa = _pyarrow()
+    cur = get_connection().cursor()
+    cur.execute(f"SELECT {', '.join(selects)} FROM {table}")
+
+    while True:
+        rows = cur.fetchmany(batch_rows)
+
+        if not rows:
+            break
+
+        columns = list(zip(*rows))
+        yield pa.record_batch([pa.array(col, type=f.type) for col, f in zip(columns, schema)], schema=schema)
+
+
+def export_dataset(out_dir: str, fmt: str = EXPORT_FORMAT, batch_rows: int = EXPORT_BATCH_ROWS) -> Dict[str, int]:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    pa = _pyarrow()
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {}
+
+    for table, partition_column in EXPORT_TABLES.items():
+        schema, selects = _table_schema(table, partition_column if fmt == "parquet" else None)
+
+        if len(schema) == 0:
+            continue
+
+        rows = 0
+
+        def counted(batches):
+            nonlocal rows
+            for batch in batches:
+                rows += batch.num_rows
+                yield batch
+
+        batches = counted(_record_batches(table, schema, selects, batch_rows))
+
+        if fmt == "parquet":
+            path = os.path.join(out_dir, table)
+            shutil.rmtree(path, ignore_errors=True)
+            partitioning = None
+
+            if partition_column:
+                partitioning = pa.dataset.partitioning(
+                    pa.schema([schema.field(p) for p in PARTITION_COLUMNS]), flavor="hive")
+
+            pa.dataset.write_dataset(batches, path, schema=schema, format="parquet",
+                                     partitioning=partitioning, existing_data_behavior="overwrite_or_ignore")
+
+            # write_dataset creates nothing for an empty table; keep the schema readable
+            if rows == 0:
+                os.makedirs(path, exist_ok=True)
+                pa.parquet.write_table(schema.empty_table(), os.path.join(path, "part-0.parquet"))
+
+        else:
+            # Uncompressed IPC file format: pa.memory_map() reads it back zero-copy
+            with pa.OSFile(os.path.join(out_dir, f"{table}.arrow"), "wb") as sink:
+                with pa.ipc.new_file(sink, schema) as writer:
+                    for batch in batches:
+                        writer.write_batch(batch)
+
+        counts[table] = rows
+        print(f"Exported {rows} rows from {table}.")
+
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": fmt,
+            "schema_version": get_metadata(SCHEMA_VERSION_KEY),
+            "exported_at": datetime.now().isoformat(timespec="seconds"),
+            "tables": counts,
+        }, f, indent=2)
+
+    return counts
+
+
+# READ / IMPORT
+
+def read_manifest(data_dir: str) -> Dict:
+    with open(os.path.join(data_dir, MANIFEST_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_table(data_dir: str, table: str, columns: Optional[List[str]] = None):
+    pa = _pyarrow()
+    fmt = read_manifest(data_dir)["format"]
+
+    if fmt == "arrow":
+        with pa.memory_map(os.path.join(data_dir, f"{table}.arrow"), "r") as source:
+            loaded = pa.ipc.open_file(source).read_all()
+
+        return loaded.select(columns) if columns else loaded
+
+    dataset = pa.dataset.dataset(os.path.join(data_dir, table), format="parquet", partitioning="hive")
+
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name not in PARTITION_COLUMNS]
+
+    return dataset.to_table(columns=columns)
+
+
+def import_dataset(in_dir: str, batch_rows: int = EXPORT_BATCH_ROWS) -> Dict[str, int]:
+    # Loads an export back into SQLite; rows replace existing rows with the same keys
+    create_tables()
+    manifest = read_manifest(in_dir)
+    counts = {}
+
+    for table in manifest["tables"]:
+        data = read_table(in_dir, table)
+        columns = data.column_names
+        sql = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+        with transaction() as cur:
+            for batch in data.to_batches(max_chunksize=batch_rows):
+                cur.executemany(sql, zip(*(col.to_pylist() for col in batch.columns)))
+
+        counts[table] = data.num_rows
+        print(f"Imported {data.num_rows} rows into {table}.")
+
+    return counts
+
+
+# COLUMNAR LOADERS FOR FILE-BACKED ANALYSIS (same shapes as the SQLite loaders in analysis.py)
+
+def date_days(dates) -> np.ndarray:
+    # ISO date strings -> int32 days since epoch, -1 where the date does not parse
+    pa = _pyarrow()
+    pc = pa.compute
+    parsed = pc.strptime(pc.utf8_slice_codeunits(dates, 0, 10), format="%Y-%m-%d", unit="s", error_is_null=True)
+    days = pc.cast(pc.cast(parsed, pa.date32()), pa.int32())
+    return pc.fill_null(days, -1).to_numpy()
+
+
+def rates_from_files(data_dir: str, series_id: str):
+    pc = _pyarrow().compute
+    rates = read_table(data_dir, "rates_daily", ["series_id", "date", "value"])
+    rates = rates.filter(pc.equal(rates["series_id"], series_id)).sort_by("date")
+    return date_days(rates["date"]), rates["value"].to_numpy().astype(np.float64)
+
+
+def filing_days_from_files(data_dir: str) -> np.ndarray:
+    days = date_days(read_table(data_dir, "filings", ["filing_date"])["filing_date"])
+    return days[days >= 0]
+
+
+def filings_per_month_from_files(data_dir: str):
+    pc = _pyarrow().compute
+    months = pc.utf8_slice_codeunits(read_table(data_dir, "filings", ["filing_date"])["filing_date"], 0, 7)
+    counts = pc.value_counts(months)
+    return sorted((ym.as_py(), n.as_py()) for ym, n in zip(counts.field("values"), counts.field("counts"))
+                  if ym.as_py())
+
+
+def event_returns_from_files(data_dir: str) -> Dict[str, np.ndarray]:
+    pc = _pyarrow().compute
+    returns = read_table(data_dir, "event_returns")
+    company_ids = read_table(data_dir, "companies", ["id"])["id"]
+    returns = returns.filter(pc.is_in(returns["company_id"], value_set=company_ids))
+
+    # Legacy calendar-day rows (migration 7) don't mix with the trading-day windows
+    if "calendar_days" in returns.column_names:
+        returns = returns.filter(pc.equal(pc.fill_null(returns["calendar_days"], 0), 0))
+
+    def values(name):
+        if name not in returns.column_names:
+            return np.full(returns.num_rows, np.nan)
+        return returns[name].to_numpy().astype(np.float64)
+
+    return {
+        "company_id": returns["company_id"].to_numpy().astype(np.int64),
+        "filing_day": date_days(returns["filing_date"]),
+        "window_start": returns["window_start"].to_numpy().astype(np.int32),
+        "window_end": returns["window_end"].to_numpy().astype(np.int32),
+        "return_pct": values("return_pct"),
+        "abnormal_return_pct": values("abnormal_return_pct"),
+    }
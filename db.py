@@ -1,9 +1,311 @@
 # db.py
+import itertools
+import re
 import sqlite3
-from config import DB_NAME
+import threading
+from contextlib import contextmanager
+from config import (
+    DB_NAME, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_CACHE_SIZE,
+    SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT_MS, DB_EXPLAIN_QUERIES
+)
 
-def get_connection():
-    return sqlite3.connect(DB_NAME)
+# One tuned connection per (thread, database file), reused across calls
+_local = threading.local()
+
+SCHEMA_VERSION_KEY = "schema_version"
+
+# Return histograms bucket values (in % points) into bins of this width; it is baked into the
+# triggers below, so changing it needs a new migration that rebuilds return_histogram
+RETURN_HISTOGRAM_BIN_WIDTH = 0.01
+RETURN_MEASURES = ("return_pct", "abnormal_return_pct")
+
+
+def _filings_daily_triggers():
+    bump = """
+        INSERT INTO filings_daily (day, n) VALUES (coalesce(substr({row}.filing_date, 1, 10), ''), {delta})
+        ON CONFLICT(day) DO UPDATE SET n = n + ({delta});
+    """
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_filings_daily_insert AFTER INSERT ON filings BEGIN
+            {bump.format(row="NEW", delta=1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_filings_daily_delete AFTER DELETE ON filings BEGIN
+            {bump.format(row="OLD", delta=-1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_filings_daily_update AFTER UPDATE OF filing_date ON filings BEGIN
+            {bump.format(row="OLD", delta=-1)}
+            {bump.format(row="NEW", delta=1)}
+        END""",
+    ]
+
+
+def _return_histogram_triggers(trading_days_only=False):
+    # One histogram bin count and one running (n, sum, sum of squares) per measure and window;
+    # trading_days_only leaves out legacy calendar-day rows (calendar_days = 1, migration 7)
+    def bump(row, measure, delta):
+        value = f"{row}.{measure}"
+        numeric = f"typeof({value}) IN ('real', 'integer')" + (f" AND {row}.calendar_days = 0" if trading_days_only else "")
+        return f"""
+            INSERT INTO return_histogram (measure, window_start, window_end, bin, n)
+            SELECT '{measure}', {row}.window_start, {row}.window_end,
+                   CAST(round({value} / {RETURN_HISTOGRAM_BIN_WIDTH}) AS INTEGER), {delta}
+            WHERE {numeric}
+            ON CONFLICT(measure, window_start, window_end, bin) DO UPDATE SET n = n + ({delta});
+            INSERT INTO return_window_totals (measure, window_start, window_end, n, total, total_sq)
+            SELECT '{measure}', {row}.window_start, {row}.window_end, {delta}, {delta} * {value}, {delta} * {value} * {value}
+            WHERE {numeric}
+            ON CONFLICT(measure, window_start, window_end) DO UPDATE SET
+                n = n + excluded.n, total = total + excluded.total, total_sq = total_sq + excluded.total_sq;
+        """
+
+    def all_measures(row, delta):
+        return "".join(bump(row, m, delta) for m in RETURN_MEASURES)
+
+    updated = [*RETURN_MEASURES, "window_start", "window_end"] + (["calendar_days"] if trading_days_only else [])
+
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_return_histogram_insert AFTER INSERT ON event_returns BEGIN
+            {all_measures("NEW", 1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_return_histogram_delete AFTER DELETE ON event_returns BEGIN
+            {all_measures("OLD", -1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_return_histogram_update
+            AFTER UPDATE OF {", ".join(updated)} ON event_returns BEGIN
+            {all_measures("OLD", -1)}
+            {all_measures("NEW", 1)}
+        END""",
+    ]
+
+
+def _return_histogram_backfill(trading_days_only=False):
+    where = " AND calendar_days = 0" if trading_days_only else ""
+    return [
+        stmt
+        for m in RETURN_MEASURES
+        for stmt in (
+            f"""INSERT INTO return_histogram (measure, window_start, window_end, bin, n)
+                SELECT '{m}', window_start, window_end, CAST(round({m} / {RETURN_HISTOGRAM_BIN_WIDTH}) AS INTEGER), COUNT(*)
+                FROM event_returns WHERE typeof({m}) IN ('real', 'integer'){where}
+                GROUP BY 1, 2, 3, 4""",
+            f"""INSERT INTO return_window_totals (measure, window_start, window_end, n, total, total_sq)
+                SELECT '{m}', window_start, window_end, COUNT(*), SUM({m}), SUM({m} * {m})
+                FROM event_returns WHERE typeof({m}) IN ('real', 'integer'){where}
+                GROUP BY 1, 2, 3""",
+        )
+    ]
+
+
+# Versioned schema changes, applied in order by migrate() and tracked in metadata
+MIGRATIONS = [
+    (1, "index filings by company and date (pipeline GROUP BY / MIN join)", [
+        "CREATE INDEX IF NOT EXISTS idx_filings_company_date ON filings(company_id, filing_date)",
+    ]),
+    (2, "index filings by date (rate-bucket as-of lookups, date ranges)", [
+        "CREATE INDEX IF NOT EXISTS idx_filings_filing_date ON filings(filing_date)",
+    ]),
+    (3, "expression index for the per-month aggregation", [
+        "CREATE INDEX IF NOT EXISTS idx_filings_month ON filings(substr(filing_date, 1, 7))",
+    ]),
+    (4, "market-model abnormal returns alongside raw event returns", [
+        "ALTER TABLE event_returns ADD COLUMN abnormal_return_pct REAL",
+        "ALTER TABLE event_returns ADD COLUMN market_beta REAL",
+    ]),
+    (5, "seed multi-series rate observations from the legacy 10Y table", [
+        """INSERT OR IGNORE INTO rate_observations (series_id, date, value)
+           SELECT 'DGS10', date, treasury_10y FROM interest_rates WHERE date IS NOT NULL""",
+    ]),
+    (6, "trigger-maintained filing counts per day and return histograms per window", [
+        "DELETE FROM filings_daily",
+        "DELETE FROM return_histogram",
+        "DELETE FROM return_window_totals",
+        *_filings_daily_triggers(),
+        *_return_histogram_triggers(),
+        """INSERT INTO filings_daily (day, n)
+           SELECT coalesce(substr(filing_date, 1, 10), ''), COUNT(*) FROM filings GROUP BY 1""",
+        *_return_histogram_backfill(),
+    ]),
+    (7, "carry legacy stock_returns over as calendar-day event windows", [
+        # calendar_days = 1: offsets are calendar days from the filing (pre-event-study rows),
+        # kept out of the trading-day statistics; recomputing an event overwrites them
+        "ALTER TABLE event_returns ADD COLUMN calendar_days INTEGER NOT NULL DEFAULT 0",
+        *(
+            f"""INSERT OR IGNORE INTO event_returns
+                (company_id, filing_date, window_start, window_end, return_pct, calendar_days)
+                SELECT company_id, filing_date, {start}, {end}, {column}, 1 FROM stock_returns
+                WHERE company_id IS NOT NULL AND filing_date IS NOT NULL AND {column} IS NOT NULL"""
+            for start, end, column in ((0, 5, "return_day0_to_day5"), (5, 10, "return_day5_to_day10"))
+        ),
+    ]),
+    (8, "densify seeded rate observations into rates_daily", [
+        # Same fill as fred_api.rebuild_daily_rates: every Mon-Fri from the first observation
+        # through today gets the latest non-null value, for series without any dense rows yet
+        """WITH RECURSIVE
+               series (series_id, first_day) AS (
+                   SELECT series_id, MIN(date) FROM rate_observations
+                   WHERE value IS NOT NULL AND series_id NOT IN (SELECT DISTINCT series_id FROM rates_daily)
+                   GROUP BY series_id
+               ),
+               days (series_id, day) AS (
+                   SELECT series_id, first_day FROM series
+                   UNION ALL
+                   SELECT series_id, date(day, '+1 day') FROM days WHERE day < date('now', 'localtime')
+               )
+           INSERT OR IGNORE INTO rates_daily (date, series_id, value)
+           SELECT day, series_id, (
+               SELECT value FROM rate_observations o
+               WHERE o.series_id = days.series_id AND o.date <= days.day AND o.value IS NOT NULL
+               ORDER BY o.date DESC LIMIT 1
+           )
+           FROM days WHERE strftime('%w', day) NOT IN ('0', '6')""",
+    ]),
+    (9, "drop the per-month expression index (monthly counts come from filings_daily)", [
+        "DROP INDEX IF EXISTS idx_filings_month",
+    ]),
+    (10, "keep legacy calendar-day rows out of the return histograms", [
+        "DROP TRIGGER IF EXISTS trg_return_histogram_insert",
+        "DROP TRIGGER IF EXISTS trg_return_histogram_delete",
+        "DROP TRIGGER IF EXISTS trg_return_histogram_update",
+        "DELETE FROM return_histogram",
+        "DELETE FROM return_window_totals",
+        *_return_histogram_triggers(trading_days_only=True),
+        *_return_histogram_backfill(trading_days_only=True),
+    ]),
+    (11, "key rates_daily by (series_id, date): every reader filters on one series", [
+        """CREATE TABLE rates_daily_by_series (
+               date TEXT NOT NULL,
+               series_id TEXT NOT NULL,
+               value REAL NOT NULL,
+               PRIMARY KEY (series_id, date)
+           )""",
+        "INSERT INTO rates_daily_by_series (date, series_id, value) SELECT date, series_id, value FROM rates_daily",
+        "DROP TABLE rates_daily",
+        "ALTER TABLE rates_daily_by_series RENAME TO rates_daily",
+    ]),
+]
+
+
+# DEBUG: EXPLAIN QUERY PLAN for every distinct query or DML statement (DB_EXPLAIN_QUERIES=1);
+# executemany statements are explained with their first parameter set, DDL and PRAGMAs never
+_explained = set()
+_explained_lock = threading.Lock()
+_EXPLAINED_STATEMENT = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+class ExplainCursor(sqlite3.Cursor):
+    def _explain(self, sql, parameters):
+        statement = sql.strip()
+
+        if not _EXPLAINED_STATEMENT.match(statement):
+            return
+
+        with _explained_lock:
+            first_time = statement not in _explained
+            _explained.add(statement)
+
+        if not first_time:
+            return
+
+        plan = sqlite3.Cursor(self.connection).execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+
+        # Plain INSERT ... VALUES has no plan worth printing
+        if plan:
+            print("EXPLAIN QUERY PLAN\n    " + " ".join(statement.split()))
+
+            for _, parent, _, detail in plan:
+                print(f"    [{parent}] {detail}")
+
+    def execute(self, sql, parameters=()):
+        self._explain(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        rows = iter(seq_of_parameters)
+        first = next(rows, None)
+
+        if first is None:
+            return super().executemany(sql, [])
+
+        self._explain(sql, first)
+        return super().executemany(sql, itertools.chain([first], rows))
+
+
+class ExplainConnection(sqlite3.Connection):
+    def cursor(self, factory=ExplainCursor):
+        return super().cursor(factory)
+
+
+def _open_connection(db_name: str) -> sqlite3.Connection:
+    factory = ExplainConnection if DB_EXPLAIN_QUERIES else sqlite3.Connection
+    conn = sqlite3.connect(db_name, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, factory=factory)
+    conn.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {int(SQLITE_CACHE_SIZE)}")
+    conn.execute(f"PRAGMA mmap_size = {int(SQLITE_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    # INSERT OR REPLACE must fire delete triggers for the rows it replaces (materialized aggregates)
+    conn.execute("PRAGMA recursive_triggers = ON")
+    return conn
+
+
+def get_connection(db_name: str = None) -> sqlite3.Connection:
+    # Shared per-thread connection: callers must not close it
+    db_name = db_name or DB_NAME
+    connections = getattr(_local, "connections", None)
+
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_name)
+
+    if conn is None:
+        conn = connections[db_name] = _open_connection(db_name)
+
+    return conn
+
+
+@contextmanager
+def transaction(db_name: str = None):
+    # Yields a cursor inside BEGIN IMMEDIATE ... COMMIT; nested calls join the outer transaction
+    conn = get_connection(db_name)
+    cur = conn.cursor()
+
+    if conn.in_transaction:
+        yield cur
+        return
+
+    cur.execute("BEGIN IMMEDIATE")
+
+    try:
+        yield cur
+
+    except BaseException:
+        conn.rollback()
+        raise
+
+    conn.commit()
+
+
+def get_metadata(key: str, default=None):
+    cur = get_connection().cursor()
+    cur.execute("SELECT value FROM metadata WHERE key = ?", (key,))
+    row = cur.fetchone()
+    return row[0] if row else default
+
+
+def set_metadata(key: str, value) -> None:
+    with transaction() as cur:
+        cur.execute("""
+            INSERT INTO metadata (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (key, str(value)))
+
+
+def get_metadata_prefix(prefix: str) -> dict:
+    cur = get_connection().cursor()
+    cur.execute("SELECT key, value FROM metadata WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+    return dict(cur.fetchall())
 
 
 def create_tables():
@@ -46,6 +348,43 @@ def create_tables():
         )
     """)
 
+    # EVENT RETURNS (long format: one row per event and trading-day window)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS event_returns (
+            company_id INTEGER NOT NULL,
+            filing_date TEXT NOT NULL,
+            window_start INTEGER NOT NULL,
+            window_end INTEGER NOT NULL,
+            return_pct REAL,
+            FOREIGN KEY (company_id) REFERENCES companies(id),
+            PRIMARY KEY (company_id, filing_date, window_start, window_end)
+        )
+    """)
+
+    # STOCK PRICE CACHE (EOD bars keyed by ticker/date)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_prices (
+            ticker TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume REAL,
+            PRIMARY KEY (ticker, date)
+        )
+    """)
+
+    # Date ranges already requested per ticker (weekends/holidays have no bars)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS price_coverage (
+            ticker TEXT NOT NULL,
+            date_from TEXT NOT NULL,
+            date_to TEXT NOT NULL,
+            PRIMARY KEY (ticker, date_from)
+        )
+    """)
+
     # INTEREST RATES
     cur.execute("""
         CREATE TABLE IF NOT EXISTS interest_rates (
@@ -55,6 +394,59 @@ def create_tables():
         )
     """)
 
+    # FRED OBSERVATIONS (raw, as published; NULL for missing values)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rate_observations (
+            series_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            value REAL,
+            PRIMARY KEY (series_id, date)
+        )
+    """)
+
+    # DAILY RATES (every business day, last observation forward-filled)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rates_daily (
+            date TEXT NOT NULL,
+            series_id TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (series_id, date)
+        )
+    """)
+
+    # MATERIALIZED AGGREGATES (kept current by triggers, see migration 6)
+    # Filings per filing day: monthly and rate-bucket counts aggregate over days, not filings
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS filings_daily (
+            day TEXT PRIMARY KEY,
+            n INTEGER NOT NULL
+        )
+    """)
+
+    # Histogram sketch of each return measure per event window (bin = round(value / width))
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS return_histogram (
+            measure TEXT NOT NULL,
+            window_start INTEGER NOT NULL,
+            window_end INTEGER NOT NULL,
+            bin INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (measure, window_start, window_end, bin)
+        )
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS return_window_totals (
+            measure TEXT NOT NULL,
+            window_start INTEGER NOT NULL,
+            window_end INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            total REAL NOT NULL,
+            total_sq REAL NOT NULL,
+            PRIMARY KEY (measure, window_start, window_end)
+        )
+    """)
+
     # METADATA
     cur.execute("""
         CREATE TABLE IF NOT EXISTS metadata (
@@ -64,4 +456,27 @@ def create_tables():
     """)
 
     conn.commit()
-    conn.close()
\ No newline at end of file
+
+    migrate()
+
+
+def migrate() -> int:
+    version = int(get_metadata(SCHEMA_VERSION_KEY, 0))
+
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+
+        with transaction() as cur:
+            for statement in statements:
+                cur.execute(statement)
+
+            cur.execute("""
+                INSERT INTO metadata (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (SCHEMA_VERSION_KEY, str(target)))
+
+        print(f"Applied schema migration {target}: {description}")
+        version = target
+
+    return version
@@ -0,0 +1,187 @@
+import numpy as np
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+from config import EVENT_WINDOWS, EVENT_DEDUP_DAYS, ESTIMATION_WINDOW, MIN_ESTIMATION_DAYS
+
+# Event day 0 is the first trading day on/after the filing; if the first bar after the
+# filing is further away than this, the series has a hole and the event is dropped
+MAX_DAY0_GAP_DAYS = 7
+
+
+def window_label(window: Tuple[int, int]) -> str:
+    return f"Day{window[0]} → Day{window[1]}"
+
+
+def trading_to_calendar_days(n: int) -> int:
+    # 5 trading days per 7 calendar days, plus slack for holidays
+    return (abs(n) * 7 + 4) // 5 + 7
+
+
+def window_span(windows: List[Tuple[int, int]]) -> Tuple[int, int]:
+    return min(0, min(w[0] for w in windows)), max(0, max(w[1] for w in windows))
+
+
+def event_price_range(filing_date: str, windows: List[Tuple[int, int]] = EVENT_WINDOWS) -> Optional[Tuple[str, str]]:
+    # Calendar date range of bars needed to evaluate every window around one filing
+    try:
+        fd = date.fromisoformat(filing_date[:10])
+
+    except (TypeError, ValueError):
+        return None
+
+    lo, hi = window_span(windows)
+
+    return (
+        (fd - timedelta(days=trading_to_calendar_days(lo) if lo < 0 else 0)).isoformat(),
+        (fd + timedelta(days=trading_to_calendar_days(hi))).isoformat()
+    )
+
+
+def dedupe_event_dates(filing_dates: List[str], min_gap_days: int = EVENT_DEDUP_DAYS) -> List[str]:
+    # Filings of one company that land within min_gap_days of the previously kept event
+    # (same offering re-filed, amendments) are treated as that same event
+    kept = []
+    last = None
+
+    for d in sorted(set(filing_dates)):
+        try:
+            day = date.fromisoformat(d[:10])
+
+        except (TypeError, ValueError):
+            continue
+
+        if last is None or (day - last).days > min_gap_days:
+            kept.append(d)
+            last = day
+
+    return kept
+
+
+def to_day_numbers(date_strings) -> np.ndarray:
+    # ISO date strings -> days since 1970-01-01
+    return np.array([d[:10] for d in date_strings], dtype="datetime64[D]").astype(np.int64)
+
+
+def event_price_matrix(price_days: np.ndarray, closes: np.ndarray, event_days: np.ndarray,
+                       lo: int, hi: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Closes and dates at trading-day offsets lo..hi around each event's day 0, as
+    # (events, hi - lo + 1) matrices; NaN / -1 where the offset falls outside the series
+    event_days = np.asarray(event_days, dtype=np.int64)
+    n = len(price_days)
+    width = hi - lo + 1
+    close_mat = np.full((len(event_days), width), np.nan)
+    day_mat = np.full((len(event_days), width), -1, dtype=np.int64)
+
+    if n == 0 or len(event_days) == 0:
+        return close_mat, day_mat
+
+    day0 = np.searchsorted(price_days, event_days, side="left")
+    ok = day0 < n
+    ok[ok] = price_days[day0[ok]] - event_days[ok] <= MAX_DAY0_GAP_DAYS
+
+    idx = day0[:, None] + np.arange(lo, hi + 1)[None, :]
+    inside = ok[:, None] & (idx >= 0) & (idx < n)
+    idx = np.clip(idx, 0, n - 1)
+
+    close_mat[inside] = closes[idx[inside]]
+    day_mat[inside] = price_days[idx[inside]]
+    return close_mat, day_mat
+
+
+def returns_from_matrix(close_mat: np.ndarray, lo: int, windows: List[Tuple[int, int]]) -> np.ndarray:
+    starts = np.array([w[0] for w in windows]) - lo
+    ends = np.array([w[1] for w in windows]) - lo
+    p_a = close_mat[:, starts]
+    p_b = close_mat[:, ends]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (p_b / p_a - 1) * 100
+
+    out[~np.isfinite(out)] = np.nan
+    return out
+
+
+# ABNORMAL RETURNS (market model against a benchmark series)
+
+def align_to_benchmark(day_mat: np.ndarray, bench_days: np.ndarray, bench_closes: np.ndarray) -> np.ndarray:
+    # Benchmark close on exactly the same trading dates as each stock observation
+    if len(bench_days) == 0:
+        return np.full(day_mat.shape, np.nan)
+
+    pos = np.clip(np.searchsorted(bench_days, day_mat), 0, len(bench_days) - 1)
+    match = (day_mat >= 0) & (bench_days[pos] == day_mat)
+    return np.where(match, bench_closes[pos], np.nan)
+
+
+def market_model_car(close_mat: np.ndarray, bench_mat: np.ndarray, lo: int,
+                     windows: List[Tuple[int, int]],
+                     estimation_window: Tuple[int, int] = ESTIMATION_WINDOW,
+                     min_obs: int = MIN_ESTIMATION_DAYS) -> Tuple[np.ndarray, np.ndarray]:
+    # Batched over all events at once. Daily returns column j is the move from offset
+    # lo + j to lo + j + 1. Alpha/beta are OLS on the estimation window; CAR over [a, b]
+    # sums abnormal returns of offsets a+1..b and is NaN unless every day is present.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = close_mat[:, 1:] / close_mat[:, :-1] - 1
+        rm = bench_mat[:, 1:] / bench_mat[:, :-1] - 1
+
+    r[~np.isfinite(r)] = np.nan
+    rm[~np.isfinite(rm)] = np.nan
+
+    est = slice(estimation_window[0] - lo, estimation_window[1] - lo)
+    er, em = r[:, est], rm[:, est]
+    both = np.isfinite(er) & np.isfinite(em)
+    count = both.sum(axis=1)
+
+    er = np.where(both, er, 0.0)
+    em = np.where(both, em, 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_r = er.sum(axis=1) / count
+        mean_m = em.sum(axis=1) / count
+        dm = np.where(both, em - mean_m[:, None], 0.0)
+        dr = np.where(both, er - mean_r[:, None], 0.0)
+        beta = (dr * dm).sum(axis=1) / (dm * dm).sum(axis=1)
+        alpha = mean_r - beta * mean_m
+
+    beta[(count < min_obs) | ~np.isfinite(beta)] = np.nan
+    alpha[np.isnan(beta)] = np.nan
+
+    ar = r - alpha[:, None] - beta[:, None] * rm
+
+    # Prefix sums turn every window's CAR into two lookups
+    missing = np.concatenate([np.zeros((len(ar), 1), dtype=np.int64), np.cumsum(np.isnan(ar), axis=1)], axis=1)
+    total = np.concatenate([np.zeros((len(ar), 1)), np.cumsum(np.nan_to_num(ar), axis=1)], axis=1)
+
+    starts = np.array([w[0] for w in windows]) - lo
+    ends = np.array([w[1] for w in windows]) - lo
+
+    car = (total[:, ends] - total[:, starts]) * 100
+    car[(missing[:, ends] - missing[:, starts]) > 0] = np.nan
+    return car, beta
+
+
+def event_return_rows(events: List[Tuple[int, str]], close_mat: np.ndarray, day_mat: np.ndarray, lo: int,
+                      windows: List[Tuple[int, int]],
+                      bench_days: Optional[np.ndarray] = None,
+                      bench_closes: Optional[np.ndarray] = None) -> List[Tuple]:
+    # event_returns rows (company_id, filing_date, start, end, return, CAR, beta) for every
+    # event x window with a raw return; CAR / beta only when a benchmark series is given
+    raw = returns_from_matrix(close_mat, lo, windows)
+
+    if bench_days is not None:
+        bench_mat = align_to_benchmark(day_mat, bench_days, bench_closes)
+        car, beta = market_model_car(close_mat, bench_mat, lo, windows)
+
+    else:
+        car = np.full(raw.shape, np.nan)
+        beta = np.full(len(events), np.nan)
+
+    return [
+        (company_id, filing_date, start, end, float(raw[i, j]),
+         None if np.isnan(car[i, j]) else float(car[i, j]),
+         None if np.isnan(beta[i]) else float(beta[i]))
+        for i, (company_id, filing_date) in enumerate(events)
+        for j, (start, end) in enumerate(windows)
+        if not np.isnan(raw[i, j])
+    ]
+
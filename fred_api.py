@@ -1,29 +1,28 @@
-import requests
-from typing import List, Dict
-from datetime import datetime, timedelta
-from config import FRED_API_KEY, FRED_BASE_URL
-from db import get_connection
+import numpy as np
+from typing import List, Dict, Optional
+from datetime import date, timedelta
+from config import FRED_API_KEY, FRED_BASE_URL, FRED_SERIES_IDS, FRED_START_YEARS_BACK
+from db import get_connection, transaction
+from http_client import get as http_get
+from instrumentation import timed, count
 
-FRED_SERIES = "DGS10"
 
-def fetch_treasury_10y(start_years_back: int = 5, max_rows: int = 25) -> List[Dict]:
+@timed()
+def fetch_fred_series(series_id: str, observation_start: str, observation_end: Optional[str] = None) -> List[Dict]:
     if not FRED_API_KEY or FRED_API_KEY.startswith("YOUR_"):
         raise ValueError("FRED_API_KEY missing in config.py")
 
-    end_date = datetime.today()
-    start_date = end_date - timedelta(days=365 * start_years_back)
-
     url = f"{FRED_BASE_URL}/series/observations"
 
     params = {
         "api_key": FRED_API_KEY,
-        "series_id": FRED_SERIES,
+        "series_id": series_id,
         "file_type": "json",
-        "observation_start": start_date.strftime("%Y-%m-%d"),
-        "observation_end": end_date.strftime("%Y-%m-%d")
+        "observation_start": observation_start,
+        "observation_end": observation_end or date.today().isoformat()
     }
 
-    resp = requests.get(url, params=params)
+    resp = http_get(url, params, source="fred")
     resp.raise_for_status()
     data = resp.json()
 
@@ -34,33 +33,104 @@ def fetch_treasury_10y(start_years_back: int = 5, max_rows: int = 25) -> List[Di
 
         try:
             value = float(value_str) if value_str not in (None, ".", "") else None
-    
+
         except ValueError:
             value = None
 
         rows.append({
             "date": obs.get("date"),
-            "treasury_10y": value
+            "value": value
         })
 
-    rows = sorted(rows, key=lambda r: datetime.fromisoformat(r["date"]))[:max_rows]
-    
-    return rows
+    return sorted(rows, key=lambda r: r["date"])
+
+
+# MULTI-SERIES INGESTION (incremental raw observations + dense business-day table)
+
+def latest_observation_date(series_id: str) -> Optional[str]:
+    cur = get_connection().cursor()
+    cur.execute("SELECT MAX(date) FROM rate_observations WHERE series_id = ?", (series_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+@timed()
+def store_fred_observations(series_id: str, rows: List[Dict]) -> None:
+    with transaction() as cur:
+        cur.executemany("""
+            INSERT INTO rate_observations (series_id, date, value)
+            VALUES (?, ?, ?)
+            ON CONFLICT(series_id, date) DO UPDATE SET value = excluded.value
+        """, [(series_id, r["date"], r["value"]) for r in rows if r.get("date")])
+
+    count("rows_written", len(rows))
+
+
+@timed()
+def rebuild_daily_rates(series_id: str, since: Optional[str] = None, until: Optional[str] = None) -> int:
+    # Forward-fills the latest non-null observation onto every business day from `since`
+    # (default: the series' first observation) through `until` (default: today)
+    cur = get_connection().cursor()
+    cur.execute("""
+        SELECT date, value FROM rate_observations
+        WHERE series_id = ? AND value IS NOT NULL
+        ORDER BY date
+    """, (series_id,))
+    obs = cur.fetchall()
+
+    if not obs:
+        return 0
+
+    obs_days = np.array([d for d, _ in obs], dtype="datetime64[D]")
+    obs_values = np.array([v for _, v in obs], dtype=np.float64)
+
+    start = np.datetime64(since or obs[0][0], "D")
+    end = np.datetime64(until or date.today().isoformat(), "D")
+    days = np.arange(start, end + 1, dtype="datetime64[D]")
+    days = days[np.is_busday(days)]
+
+    idx = np.searchsorted(obs_days, days, side="right") - 1
+    days, idx = days[idx >= 0], idx[idx >= 0]
+
+    with transaction() as cur:
+        cur.executemany("""
+            INSERT INTO rates_daily (date, series_id, value)
+            VALUES (?, ?, ?)
+            ON CONFLICT(series_id, date) DO UPDATE SET value = excluded.value
+        """, zip(days.astype(str).tolist(), [series_id] * len(days), obs_values[idx].tolist()))
+
+    count("rows_written", len(days))
+
+    return len(days)
+
+
+def sync_fred_series(series_ids: List[str] = FRED_SERIES_IDS,
+                     start_years_back: int = FRED_START_YEARS_BACK) -> Dict[str, int]:
+    # Only observations after the latest stored date are requested
+    default_start = (date.today() - timedelta(days=365 * start_years_back)).isoformat()
+    fetched = {}
+
+    for series_id in series_ids:
+        latest = latest_observation_date(series_id)
+        start = (date.fromisoformat(latest) + timedelta(days=1)).isoformat() if latest else default_start
+
+        if start > date.today().isoformat():
+            fetched[series_id] = 0
+            continue
 
+        rows = fetch_fred_series(series_id, start)
+        store_fred_observations(series_id, rows)
+        fetched[series_id] = len(rows)
 
-def store_treasury_10y_to_db(rates: List[Dict]) -> None:
-    if not rates:
-        print("No interest-rate data to store.")
-        return
+        # Re-densify from the day after the last filled row (or the start of the series)
+        cur = get_connection().cursor()
+        cur.execute("SELECT MAX(date) FROM rates_daily WHERE series_id = ?", (series_id,))
+        last_dense = cur.fetchone()[0]
+        since = (date.fromisoformat(last_dense) + timedelta(days=1)).isoformat() if last_dense else None
 
-    conn = get_connection()
-    cur = conn.cursor()
+        if rows and since:
+            since = min(since, rows[0]["date"])
 
-    for r in rates:
-        cur.execute("""
-            INSERT OR IGNORE INTO interest_rates (date, treasury_10y)
-            VALUES (?, ?)
-        """, (r["date"], r["treasury_10y"]))
+        rebuild_daily_rates(series_id, since)
 
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    return fetched
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit, parse_qsl, urlencode, urlunsplit
+import requests
+from config import HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_TTLS
+
+# Credentials never become part of a cache key (the same request made with another key is a hit)
+SECRET_PARAMS = {"token", "api_token", "api_key", "apikey"}
+
+_lock = threading.Lock()
+_total_bytes: Optional[int] = None
+
+
+class OfflineCacheMiss(requests.ConnectionError):
+    pass
+
+
+def _strip_secrets(params: Optional[Dict]) -> Dict:
+    return {k: v for k, v in (params or {}).items() if k.lower() not in SECRET_PARAMS}
+
+
+def redact_url(url: str) -> str:
+    # URL with credential query parameters removed and the rest sorted
+    parts = urlsplit(url or "")
+    query = sorted((k, v) for k, v in parse_qsl(parts.query) if k.lower() not in SECRET_PARAMS)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def cache_key(method: str, url: str, params: Optional[Dict] = None, payload: Optional[Dict] = None) -> str:
+    canonical = json.dumps({
+        "method": method.upper(),
+        "url": redact_url(url),
+        "params": _strip_secrets(params),
+        "payload": payload,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def load(key: str, source: str, cache_dir: str = HTTP_CACHE_DIR,
+         ttl: Optional[float] = None) -> Optional[requests.Response]:
+    # Fresh cached response or None; ttl defaults to the source's HTTP_CACHE_TTLS entry
+    # (missing or <= 0: never expires)
+    path = _path(key, cache_dir)
+    ttl = HTTP_CACHE_TTLS.get(source, 0) if ttl is None else ttl
+
+    try:
+        with open(path + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        if ttl > 0 and time.time() - meta["stored_at"] > ttl:
+            return None
+
+        with open(path + ".body", "rb") as f:
+            body = f.read()
+
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # Access time drives LRU eviction
+    try:
+        os.utime(path + ".body")
+
+    except OSError:
+        pass
+
+    resp = requests.Response()
+    resp.status_code = meta["status"]
+    resp.headers.update(meta.get("headers", {}))
+    resp.url = meta.get("url", "")
+    resp._content = body
+    return resp
+
+
+def store(key: str, resp: requests.Response, cache_dir: str = HTTP_CACHE_DIR,
+          max_bytes: int = HTTP_CACHE_MAX_BYTES) -> None:
+    global _total_bytes
+    path = _path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    meta = {
+        "status": resp.status_code,
+        "headers": {"Content-Type": resp.headers.get("Content-Type", "")},
+        "url": redact_url(resp.url),
+        "stored_at": time.time(),
+    }
+
+    # Write-then-rename so concurrent readers never see a partial entry
+    for suffix, data in ((".body", resp.content), (".json", json.dumps(meta).encode("utf-8"))):
+        tmp = f"{path}{suffix}.{threading.get_ident()}.tmp"
+
+        with open(tmp, "wb") as f:
+            f.write(data)
+
+        os.replace(tmp, path + suffix)
+
+    with _lock:
+        if _total_bytes is None:
+            _total_bytes = cache_size(cache_dir)
+        else:
+            _total_bytes += len(resp.content)
+
+        if _total_bytes > max_bytes:
+            _total_bytes = evict(cache_dir, max_bytes)
+
+
+def _entries(cache_dir: str):
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(".body"):
+                path = os.path.join(root, name)
+
+                try:
+                    st = os.stat(path)
+
+                except OSError:
+                    continue
+
+                yield path[:-len(".body")], st.st_size, st.st_mtime
+
+
+def cache_size(cache_dir: str = HTTP_CACHE_DIR) -> int:
+    return sum(size for _, size, _ in _entries(cache_dir))
+
+
+def evict(cache_dir: str = HTTP_CACHE_DIR, max_bytes: int = HTTP_CACHE_MAX_BYTES) -> int:
+    # Drops least recently used entries until the cache is back under 90% of max_bytes
+    entries = sorted(_entries(cache_dir), key=lambda e: e[2])
+    total = sum(size for _, size, _ in entries)
+
+    for path, size, _ in entries:
+        if total <= max_bytes * 0.9:
+            break
+
+        for suffix in (".body", ".json"):
+            try:
+                os.remove(path + suffix)
+
+            except OSError:
+                pass
+
+        total -= size
+
+    return total
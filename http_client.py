@@ -0,0 +1,192 @@
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_BACKOFF_SECONDS, HTTP_POOL_SIZE,
+    HTTP_CACHE_ENABLED, HTTP_CACHE_OFFLINE
+)
+import http_cache
+from instrumentation import count
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Keep-alive sessions per (thread, host): requests.Session is not guaranteed thread-safe,
+# so every worker thread reuses its own pooled connections to each API host
+_local = threading.local()
+
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+# RATE LIMITER (token bucket shared by all fetch workers)
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+# SESSIONS
+def get_session(url: str) -> requests.Session:
+    host = urlsplit(url).netloc
+    sessions = getattr(_local, "sessions", None)
+
+    if sessions is None:
+        sessions = _local.sessions = {}
+
+    session = sessions.get(host)
+
+    if session is None:
+        session = sessions[host] = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+
+    return session
+
+
+# PER-HOST COUNTERS
+def _empty_stats() -> Dict[str, float]:
+    return {"requests": 0, "retries": 0, "errors": 0, "cache_hits": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+
+
+def _record_cache_hit(host: str) -> None:
+    with _stats_lock:
+        _stats.setdefault(host, _empty_stats())["cache_hits"] += 1
+
+
+def _record(host: str, latency: float, status: Optional[int], retried: bool) -> None:
+    with _stats_lock:
+        s = _stats.setdefault(host, _empty_stats())
+        s["requests"] += 1
+        s["total_seconds"] += latency
+        s["max_seconds"] = max(s["max_seconds"], latency)
+
+        if retried:
+            s["retries"] += 1
+
+        if status is None or status >= 400:
+            s["errors"] += 1
+
+
+def host_stats() -> Dict[str, Dict[str, float]]:
+    # {host: {requests, retries, errors, cache_hits, total_seconds, max_seconds, avg_seconds}}
+    with _stats_lock:
+        return {
+            host: dict(s, avg_seconds=s["total_seconds"] / s["requests"] if s["requests"] else 0.0)
+            for host, s in _stats.items()
+        }
+
+
+def print_host_stats() -> None:
+    for host, s in sorted(host_stats().items()):
+        print(f"{host}: {s['requests']} requests, {s['retries']} retried, {s['errors']} errors, "
+              f"{s['cache_hits']} cache hits, "
+              f"avg {s['avg_seconds'] * 1000:.0f} ms, max {s['max_seconds'] * 1000:.0f} ms")
+
+
+# REQUESTS
+def request(method: str, url: str, params: Optional[Dict] = None, json: Optional[Dict] = None,
+            limiter: Optional[TokenBucket] = None,
+            max_retries: int = HTTP_MAX_RETRIES,
+            backoff: float = HTTP_BACKOFF_SECONDS,
+            timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+            source: Optional[str] = None,
+            cache: bool = HTTP_CACHE_ENABLED,
+            offline: bool = HTTP_CACHE_OFFLINE) -> requests.Response:
+    # Retries connection errors, timeouts and 429/5xx with exponential backoff (honoring
+    # Retry-After). Returns the last response, which may still be a 429/5xx once retries run
+    # out; raises the last exception if no response ever came back.
+    # With a source ("sec", "stockdata", "fred") responses go through the on-disk cache;
+    # offline mode ignores the TTLs, never touches the network and raises OfflineCacheMiss instead.
+    host = urlsplit(url).netloc
+    key = None
+
+    if source and (cache or offline):
+        key = http_cache.cache_key(method, url, params, json)
+        # Offline replay serves whatever is on disk, however old
+        cached = http_cache.load(key, source, ttl=0 if offline else None)
+
+        if cached is not None:
+            _record_cache_hit(host)
+            count("http_cache_hits")
+            return cached
+
+        if offline:
+            raise http_cache.OfflineCacheMiss(f"offline: no cached response for {http_cache.redact_url(url)}")
+
+    session = get_session(url)
+
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        start = time.perf_counter()
+
+        try:
+            resp = session.request(method, url, params=params, json=json, timeout=timeout)
+            error = None
+
+        except (requests.ConnectionError, requests.Timeout) as e:
+            resp, error = None, e
+
+        _record(host, time.perf_counter() - start, resp.status_code if resp is not None else None, attempt > 0)
+        count("http_requests")
+
+        if attempt > 0:
+            count("http_retries")
+
+        if resp is not None:
+            count("http_bytes", len(resp.content))
+
+        if resp is not None and resp.status_code not in RETRY_STATUS_CODES:
+            if key and resp.ok:
+                http_cache.store(key, resp)
+
+            return resp
+
+        if attempt == max_retries:
+            if resp is None:
+                raise error
+            return resp
+
+        # Honor Retry-After on 429s, otherwise exponential backoff
+        delay = backoff * (2 ** attempt)
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+
+        time.sleep(delay)
+
+
+def get(url: str, params: Optional[Dict] = None, **kwargs) -> requests.Response:
+    return request("GET", url, params=params, **kwargs)
+
+
+def post(url: str, json: Optional[Dict] = None, **kwargs) -> requests.Response:
+    return request("POST", url, json=json, **kwargs)
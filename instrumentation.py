@@ -0,0 +1,160 @@
+import cProfile
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import RUN_REPORT_PATH, PROFILE_STAGES, PROFILE_DIR
+
+# Stage records in first-start order: name -> {calls, seconds, parent, counters}
+_stages: Dict[str, Dict] = {}
+_totals: Dict[str, float] = {}
+_lock = threading.Lock()
+
+# Open stages per thread. A pool worker running a carry_stages() wrapper also works on behalf of
+# the stages that were open where the work was submitted (_inherited), so its counters and
+# stages land under the pipeline stage that started it, whichever thread that runs on.
+_stacks: Dict[int, List[str]] = {}
+_inherited: Dict[int, List[str]] = {}
+_profiling = threading.Lock()
+_started_at = datetime.now()
+
+
+def _stack(ident: Optional[int] = None) -> List[str]:
+    return _stacks.setdefault(ident or threading.get_ident(), [])
+
+
+def _context(ident: int) -> List[str]:
+    # Inherited stages, then the thread's own, without repeats
+    return list(dict.fromkeys(_inherited.get(ident, []) + _stack(ident)))
+
+
+def carry_stages(func):
+    # Wrap work before submitting it to a thread pool: captures the submitting thread's open stages
+    with _lock:
+        context = _context(threading.get_ident())
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        ident = threading.get_ident()
+
+        with _lock:
+            previous = _inherited.get(ident)
+            _inherited[ident] = context
+
+        try:
+            return func(*args, **kwargs)
+
+        finally:
+            with _lock:
+                if previous is None:
+                    _inherited.pop(ident, None)
+                else:
+                    _inherited[ident] = previous
+
+    return wrapper
+
+
+def count(name: str, n: float = 1) -> None:
+    with _lock:
+        _totals[name] = _totals.get(name, 0) + n
+
+        for stage_name in _context(threading.get_ident()):
+            counters = _stages[stage_name]["counters"]
+            counters[name] = counters.get(name, 0) + n
+
+
+@contextmanager
+def stage(name: str, profile: bool = PROFILE_STAGES):
+    stack = _stack()
+
+    with _lock:
+        parents = _context(threading.get_ident())
+        record = _stages.setdefault(name, {"calls": 0, "seconds": 0.0, "parent": parents[-1] if parents else None,
+                                           "counters": {}})
+        record["calls"] += 1
+        stack.append(name)
+
+    # cProfile can't nest (and on newer Pythons only one profiler can be active per process), so
+    # only one profiled stage at a time dumps a profile: run stages one by one to get them all
+    profiler = cProfile.Profile() if profile and _profiling.acquire(blocking=False) else None
+    start = time.perf_counter()
+
+    if profiler:
+        profiler.enable()
+
+    try:
+        yield record
+
+    finally:
+        elapsed = time.perf_counter() - start
+
+        if profiler:
+            profiler.disable()
+            _profiling.release()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, re.sub(r"[^\w.-]", "_", name) + ".prof"))
+
+        with _lock:
+            record["seconds"] += elapsed
+            stack.pop()
+
+
+def timed(name: Optional[str] = None):
+    # @timed() / @timed("label"): runs the function inside stage(label or function name)
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run_report() -> Dict:
+    # seconds is summed over calls, so stages running on worker threads can exceed wall time
+    with _lock:
+        return {
+            "started_at": _started_at.isoformat(timespec="seconds"),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "stages": [
+                {"name": name, "parent": r["parent"], "calls": r["calls"],
+                 "seconds": round(r["seconds"], 4), "counters": dict(r["counters"])}
+                for name, r in _stages.items()
+            ],
+            "totals": dict(_totals),
+        }
+
+
+def write_run_report(path: str = RUN_REPORT_PATH, extra: Optional[Dict] = None) -> Dict:
+    report = run_report()
+    report.update(extra or {})
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    return report
+
+
+def print_run_report(report: Dict) -> None:
+    for s in report["stages"]:
+        counters = ", ".join(f"{k}={v:g}" for k, v in sorted(s["counters"].items()))
+        indent = "  " if s["parent"] else ""
+        print(f"{indent}{s['name']}: {s['seconds']:.2f}s x{s['calls']}" + (f" ({counters})" if counters else ""))
+
+
+def reset() -> None:
+    global _started_at
+
+    with _lock:
+        _stages.clear()
+        _totals.clear()
+        _started_at = datetime.now()
@@ -1,25 +1,120 @@
+import argparse
 from db import create_tables
-from db import create_tables
-from pipeline import load_sec_data, load_and_store_stock_returns, load_interest_rate_data
+from pipeline import load_sec_data, load_sec_backfill, load_sec_incremental, load_and_store_stock_returns, load_interest_rate_data
 from analysis import run_analysis
+from http_client import print_host_stats, host_stats
+from instrumentation import stage, write_run_report, print_run_report
+from scheduler import make_stage, run_stages
+from config import (
+    EVENT_ALL_FILINGS, ABNORMAL_RETURNS, EXPORT_FORMAT, ANALYSIS_DATA_DIR, ANALYSIS_BY_RATE_BUCKET, RUN_REPORT_PATH,
+    STAGE_MAX_AGE_HOURS, STAGE_WORKERS, PROFILE_STAGES
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the follow-on filings database and run the analysis.")
+    parser.add_argument("--sec-mode", choices=["page", "backfill", "incremental"], default="page",
+                        help="page: fetch the next --limit filings; backfill: walk the full 5-year result set; "
+                             "incremental: fetch only filings newer than the stored filedAt watermark")
+    parser.add_argument("--limit", type=int, default=25, help="filings per run in page mode")
+    parser.add_argument("--all-filings", action="store_true",
+                        help="compute returns for every filing, not just each company's first")
+    parser.add_argument("--abnormal-returns", action="store_true", default=ABNORMAL_RETURNS,
+                        help="also compute market-model CARs against the benchmark (fetches extra history)")
+    parser.add_argument("--only", type=lambda v: v.split(","), default=None,
+                        help="comma-separated stages to run (sec, fred, returns, analysis)")
+    parser.add_argument("--skip", type=lambda v: v.split(","), default=None, help="comma-separated stages to skip")
+    parser.add_argument("--force", action="store_true", help="run stages even if their freshness marker is current")
+
+    # Without a subcommand the full fetch + analysis pipeline runs
+    commands = parser.add_subparsers(dest="command")
+
+    export_cmd = commands.add_parser("export", help="write every table to Parquet (year/month partitions) or Arrow IPC")
+    export_cmd.add_argument("out_dir")
+    export_cmd.add_argument("--format", choices=["parquet", "arrow"], default=EXPORT_FORMAT)
+
+    import_cmd = commands.add_parser("import", help="load an export back into the SQLite database")
+    import_cmd.add_argument("in_dir")
+
+    analyze_cmd = commands.add_parser("analyze", help="run only the analysis, from SQLite or an export")
+    analyze_cmd.add_argument("--data-dir", default=ANALYSIS_DATA_DIR,
+                             help="export directory to read instead of the SQLite database")
+    analyze_cmd.add_argument("--by-rate-bucket", action="store_true", default=ANALYSIS_BY_RATE_BUCKET,
+                             help="also compute return stats per rate bucket (scans every event return)")
+    return parser.parse_args()
+
+def load_sec_stage(args):
+    if args.sec_mode == "backfill":
+        load_sec_backfill()
+    elif args.sec_mode == "incremental":
+        load_sec_incremental()
+    else:
+        load_sec_data(limit=args.limit)
+
+def pipeline_stages(args):
+    # SEC -> stock returns -> analysis; the FRED sync has no upstream and runs alongside.
+    # params are part of each stage's freshness marker, so other arguments always re-run it
+    all_filings = args.all_filings or EVENT_ALL_FILINGS
+
+    return [
+        make_stage("sec", lambda: load_sec_stage(args), max_age_hours=STAGE_MAX_AGE_HOURS.get("sec", 0),
+                   params={"sec_mode": args.sec_mode, "limit": args.limit if args.sec_mode == "page" else None}),
+        make_stage("fred", load_interest_rate_data, max_age_hours=STAGE_MAX_AGE_HOURS.get("fred", 0)),
+        make_stage("returns", lambda: load_and_store_stock_returns(all_filings=all_filings,
+                                                                   abnormal=args.abnormal_returns),
+                   deps=["sec"], max_age_hours=STAGE_MAX_AGE_HOURS.get("returns", 0),
+                   params={"all_filings": all_filings, "abnormal": args.abnormal_returns}),
+        make_stage("analysis", run_analysis, deps=["returns", "fred"],
+                   max_age_hours=STAGE_MAX_AGE_HOURS.get("analysis", 0)),
+    ]
+
+def run_pipeline(args):
+    with stage("create_tables"):
+        print("Initializing database...")
+        create_tables()
+
+    # Only one stage at a time can be profiled, so profiling runs the stages one by one
+    status = run_stages(pipeline_stages(args), only=args.only, skip=args.skip, force=args.force,
+                        max_workers=1 if PROFILE_STAGES else STAGE_WORKERS)
+
+    print("HTTP requests per host:")
+    print_host_stats()
+    print("Stages:", status)
+    return status
 
 def main():
-    print("Initializing database...")
-    create_tables()
+    args = parse_args()
+
+    if args.command == "export":
+        from dataset_io import export_dataset
+        export_dataset(args.out_dir, fmt=args.format)
+        return
+
+    if args.command == "import":
+        from dataset_io import import_dataset
+        import_dataset(args.in_dir)
+        return
+
+    if args.command == "analyze":
+        # Reading SQLite needs the current schema (rates_daily, materialized aggregates)
+        if not args.data_dir:
+            create_tables()
 
-    # A) Fetch SEC convertible bond filings
-    load_sec_data(limit=25)
+        run_analysis(data_dir=args.data_dir, by_rate_bucket=args.by_rate_bucket)
+        return
 
-    # B) Fetch stock prices for companies already in DB
-    load_and_store_stock_returns()
+    try:
+        status = run_pipeline(args)
 
-    # C) Fetch interest-rate history (only 10Y)
-    load_interest_rate_data(start_years_back=5, max_rows=99999)
+    finally:
+        report = write_run_report(extra={"http_hosts": host_stats()})
+        print("\nStage timings:")
+        print_run_report(report)
+        print(f"Run report written to {RUN_REPORT_PATH}")
 
-    # D) Run analysis
-    run_analysis()
+    if "failed" in status.values():
+        raise SystemExit(1)
 
     print("main.py finished.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
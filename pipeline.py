@@ -1,106 +1,180 @@
-from db import create_tables, get_connection
-from sec_api import fetch_sec_filings, store_sec_filings_to_db
-from stock_api import fetch_stock_prices_for_11days
-from fred_api import fetch_treasury_10y, store_treasury_10y_to_db
-from datetime import datetime, timedelta
+from db import create_tables, get_connection, transaction
+from sec_api import load_sec_page_stream, backfill_sec_filings, sync_sec_filings
+from stock_api import fetch_stock_prices_concurrently
+from fred_api import sync_fred_series
+from event_study import (
+    event_price_range, dedupe_event_dates, event_return_rows, window_span
+)
+from price_panel import PricePanel
+from return_shards import compute_returns_sharded, panel_event_matrices
+from config import (
+    STOCKDATA_MAX_WORKERS, STOCKDATA_REQUESTS_PER_SECOND, SEC_PAGE_SIZE, SEC_MAX_WORKERS,
+    EVENT_WINDOWS, EVENT_ALL_FILINGS, ABNORMAL_RETURNS, BENCHMARK_TICKER, ESTIMATION_WINDOW,
+    FRED_SERIES_IDS, FRED_START_YEARS_BACK, RETURN_WORKERS, RETURN_PANEL_COMPANIES
+)
+from instrumentation import timed, stage, count
+import numpy as np
 
 # SEC
+@timed()
 def load_sec_data(limit: int = 25):
     print(f"\nFetching up to {limit} SEC filings...")
-    filings = fetch_sec_filings(limit=limit)
-    store_sec_filings_to_db(filings)
-    print(f"Inserted {len(filings)} SEC filings.\n")
+    stored = load_sec_page_stream(limit=limit)
+    print(f"Inserted {stored} SEC filings.\n")
+
+@timed()
+def load_sec_backfill(page_size: int = SEC_PAGE_SIZE, max_workers: int = SEC_MAX_WORKERS):
+    print(f"\nBackfilling SEC filings ({max_workers} pages in flight, {page_size} per page)...")
+    stored = backfill_sec_filings(page_size=page_size, max_workers=max_workers)
+    print(f"Stored {stored} SEC filings from backfill.\n")
+
+@timed()
+def load_sec_incremental(page_size: int = SEC_PAGE_SIZE):
+    print("\nSyncing SEC filings newer than the stored filedAt watermark...")
+    stored = sync_sec_filings(page_size=page_size)
+    print(f"Stored {stored} new/boundary SEC filings.\n")
 
 # STOCK PRICE
-def load_and_store_stock_returns():
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT c.id, c.ticker, MIN(f.filing_date) AS filing_date
-        FROM companies c
-        JOIN filings f ON c.id = f.company_id
-        WHERE c.ticker IS NOT NULL
-        GROUP BY c.id, c.ticker
-    """)
-    
-    rows = cur.fetchall()
+@timed()
+def load_benchmark_prices(jobs, ticker: str = BENCHMARK_TICKER):
+    # One cached fetch of the market proxy over the union of every event's price range
+    if not jobs:
+        return np.empty(0, dtype=np.int32), np.empty(0)
+
+    price_range = (ticker, min(job[2] for job in jobs), max(job[3] for job in jobs))
+
+    for _ in fetch_stock_prices_concurrently([("benchmark", *price_range)], load_prices=False):
+        pass
+
+    days, closes = PricePanel.from_db([price_range]).series(ticker)
 
-    inserted = 0
+    if not len(days):
+        print(f"No benchmark prices for {ticker}; abnormal returns will be empty.")
+
+    return days, closes
+
+
+@timed()
+def load_and_store_stock_returns(windows=EVENT_WINDOWS,
+                                 abnormal: bool = ABNORMAL_RETURNS,
+                                 all_filings: bool = EVENT_ALL_FILINGS,
+                                 max_workers: int = STOCKDATA_MAX_WORKERS,
+                                 requests_per_second: float = STOCKDATA_REQUESTS_PER_SECOND,
+                                 return_workers: int = RETURN_WORKERS):
+    cur = get_connection().cursor()
     
-    for company_id, ticker, filing_date in rows:
-        
-        if not filing_date:
-            continue
-
-        prices = fetch_stock_prices_for_11days(ticker, filing_date)
-        
-        if not prices:
-            continue
-
-        # SORT 
-        prices = sorted(prices, key=lambda x: x["date"])
-
-        # target date strings
-        day0 = filing_date
-        
-        # day5 and day10 as calendar offsets
-        try:
-            fd = datetime.fromisoformat(filing_date).date()
-        except Exception:
-            continue
-        
-        day5 = (fd + timedelta(days=5)).isoformat()
-        day10 = (fd + timedelta(days=10)).isoformat()
-
-        # find close by index, not by exact calendar date
-        def find_closest_after(target):
-            for p in prices:
-                if p["date"] >= target:
-                    return p["close"]
-            return None
-
-        day0 = filing_date
-        fd = datetime.fromisoformat(filing_date).date()
-        day5 = (fd + timedelta(days=5)).isoformat()
-        day10 = (fd + timedelta(days=10)).isoformat()
-
-        p0  = find_closest_after(day0)
-        p5  = find_closest_after(day5)
-        p10 = find_closest_after(day10)
-
-        # Require at least Day0 to Day5
-        if (p0 is None) or (p5 is None):
-            continue
-
-        ret0_5 = (p5 - p0) / p0 * 100
-
-        ret5_10 = None
-        
-        if p10 is not None and p5 != 0:
-            ret5_10 = (p10 - p5) / p5 * 100
-
-
-        # Insert or replace to keep the table idempotent
+    if all_filings:
+        # Every (company, filing_date) pair, not just each issuer's first filing
         cur.execute("""
-            INSERT INTO stock_returns (company_id, filing_date, return_day0_to_day5, return_day5_to_day10)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(company_id, filing_date) DO UPDATE SET
-                return_day0_to_day5 = excluded.return_day0_to_day5,
-                return_day5_to_day10 = excluded.return_day5_to_day10
-        """, (company_id, filing_date, ret0_5, ret5_10))
+            SELECT DISTINCT c.id, c.ticker, f.filing_date
+            FROM companies c
+            JOIN filings f ON c.id = f.company_id
+            WHERE c.ticker IS NOT NULL AND f.filing_date IS NOT NULL
+            ORDER BY c.id, f.filing_date
+        """)
+
+    else:
+        cur.execute("""
+            SELECT c.id, c.ticker, MIN(f.filing_date) AS filing_date
+            FROM companies c
+            JOIN filings f ON c.id = f.company_id
+            WHERE c.ticker IS NOT NULL
+            GROUP BY c.id, c.ticker
+        """)
+
+    company_events = {}
+
+    for company_id, ticker, filing_date in cur.fetchall():
+        if filing_date:
+            company_events.setdefault(company_id, (ticker, []))[1].append(filing_date)
+
+    # One merged price range per company, wide enough for every window (and the
+    # estimation window) of all of its events
+    span_windows = list(windows) + ([ESTIMATION_WINDOW] if abnormal else [])
+    lo, hi = window_span(span_windows)
+    jobs = []
+
+    for company_id, (ticker, filing_dates) in company_events.items():
+        filing_dates = dedupe_event_dates(filing_dates)
+        ranges = [r for r in (event_price_range(d, span_windows) for d in filing_dates) if r]
+
+        if ranges:
+            jobs.append(((company_id, tuple(filing_dates)), ticker,
+                         min(r[0] for r in ranges), max(r[1] for r in ranges)))
+
+    bench_days, bench_closes = load_benchmark_prices(jobs) if abnormal else (None, None)
+
+    # Returns are computed from array-backed price panels read back from the cache
+    fetched = fetch_stock_prices_concurrently(jobs, max_workers=max_workers,
+                                              requests_per_second=requests_per_second, load_prices=False)
+
+    if return_workers > 1:
+        # Fill the cache first, then every worker process loads the panel of its own shard of
+        # companies; the parent only merges rows for the one bulk write below
+        for _ in fetched:
+            pass
+
+        with stage("compute_returns_sharded"):
+            rows = compute_returns_sharded(jobs, windows, lo, hi, bench_days, bench_closes, workers=return_workers)
+
+    else:
+        jobs_by_key = {job[0]: job for job in jobs}
+        ready, events, close_rows, day_rows = [], [], [], []
+
+        def lay_out(batch):
+            # One contiguous panel for the batch, each company laid out on the trading-day grid
+            panel = PricePanel.from_db([job[1:] for job in batch])
+            count("price_bars", len(panel))
+            batch_events, batch_closes, batch_days = panel_event_matrices(panel, batch, lo, hi)
+            events.extend(batch_events)
+            close_rows.extend(batch_closes)
+            day_rows.extend(batch_days)
+
+        # Companies are laid out in batches as soon as their prices are cached
+        for key, _, _ in fetched:
+            ready.append(jobs_by_key[key])
+
+            if len(ready) >= max(1, RETURN_PANEL_COMPANIES):
+                lay_out(ready)
+                ready = []
+
+        if ready:
+            lay_out(ready)
+
+        # Every event x window in one batched matrix computation
+        with stage("compute_returns"):
+            rows = event_return_rows(events, np.vstack(close_rows), np.vstack(day_rows), lo, windows,
+                                     bench_days, bench_closes) if events else []
+
+    if not rows:
+        print("No events to compute returns for.")
+        return
+
+    # Single bulk upsert keeps the table idempotent
+    with stage("write_event_returns"), transaction() as cur:
+        cur.executemany("""
+            INSERT INTO event_returns
+            (company_id, filing_date, window_start, window_end, return_pct, abnormal_return_pct, market_beta)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(company_id, filing_date, window_start, window_end) DO UPDATE SET
+                return_pct = excluded.return_pct,
+                abnormal_return_pct = excluded.abnormal_return_pct,
+                market_beta = excluded.market_beta,
+                calendar_days = 0
+        """, rows)
+        count("rows_written", len(rows))
+
+    print(f"Inserted/updated {len(rows)} event return rows ({len(windows)} windows).")
 
-        inserted += 1
+# FRED
+@timed()
+def load_interest_rate_data(series_ids=FRED_SERIES_IDS, start_years_back: int = FRED_START_YEARS_BACK):
+    print(f"\nSyncing FRED series: {', '.join(series_ids)}...")
+    fetched = sync_fred_series(series_ids, start_years_back=start_years_back)
 
-    conn.commit()
-    conn.close()
-    print(f"Inserted/updated {inserted} compact stock return rows.")
+    for series_id, n in fetched.items():
+        print(f"  {series_id}: {n} new observations")
 
-# FRED
-def load_interest_rate_data(start_years_back: int = 5, max_rows: int = 25):
-    print(f"\nFetching Treasury 10Y data...")
-    rates = fetch_treasury_10y(start_years_back=start_years_back, max_rows=max_rows)
-    store_treasury_10y_to_db(rates)
-    print(f"Inserted {len(rates)} interest-rate rows.\n")
+    print(f"Inserted {sum(fetched.values())} interest-rate observations.\n")
 
 
@@ -0,0 +1,95 @@
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from db import get_connection
+
+# Rows pulled per fetchmany while loading, so a multi-million-bar load never holds more than
+# this many Python tuples at once
+FETCH_ROWS = 100_000
+
+
+def day_ordinal(date_str: str) -> int:
+    # ISO date -> days since 1970-01-01 (same numbering as event_study.to_day_numbers)
+    return int(np.datetime64(date_str[:10], "D").astype(np.int64))
+
+
+class PricePanel:
+    # Daily closes of many tickers in contiguous arrays: the bars of ticker i are
+    # days[offsets[i]:offsets[i + 1]] (int32 day ordinals, ascending) and the matching closes
+    # (float64, NaN where the close is missing). 12 bytes per bar, so 10M bars take ~120 MB.
+
+    def __init__(self, tickers: List[str], offsets: np.ndarray, days: np.ndarray, closes: np.ndarray):
+        self.tickers = list(tickers)
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.days = np.asarray(days, dtype=np.int32)
+        self.closes = np.asarray(closes, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    @classmethod
+    def from_arrays(cls, tickers: List[str], ticker_idx: np.ndarray, days: np.ndarray,
+                    closes: np.ndarray) -> "PricePanel":
+        # Bars as parallel (ticker index, day, close) arrays in any order; only sorted if needed
+        ticker_idx = np.asarray(ticker_idx, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        order_key = (ticker_idx << 32) + days
+
+        if len(order_key) > 1 and np.any(np.diff(order_key) < 0):
+            order = np.argsort(order_key, kind="stable")
+            ticker_idx, days, closes = ticker_idx[order], days[order], np.asarray(closes)[order]
+
+        offsets = np.zeros(len(tickers) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ticker_idx, minlength=len(tickers)), out=offsets[1:])
+        return cls(tickers, offsets, days, closes)
+
+    @classmethod
+    def from_db(cls, ranges: Iterable[Tuple[str, str, str]], db_name: Optional[str] = None) -> "PricePanel":
+        # Cached bars for (ticker, date_from, date_to) ranges in one query; ranges of the same
+        # ticker are merged to their overall span
+        spans: Dict[str, List[str]] = {}
+
+        for ticker, date_from, date_to in ranges:
+            span = spans.setdefault(ticker, [date_from, date_to])
+            span[0], span[1] = min(span[0], date_from), max(span[1], date_to)
+
+        tickers = list(spans)
+        cur = get_connection(db_name).cursor()
+        cur.execute("""
+            SELECT CAST(r.key AS INTEGER), CAST(julianday(p.date) - 2440587.5 AS INTEGER), p.close
+            FROM json_each(?) r
+            JOIN stock_prices p
+              ON p.ticker = json_extract(r.value, '$[0]')
+             AND p.date BETWEEN json_extract(r.value, '$[1]') AND json_extract(r.value, '$[2]')
+        """, (json.dumps([[t] + spans[t] for t in tickers]),))
+
+        # No ORDER BY: the index walk already returns bars grouped by range and in date order,
+        # and from_arrays only sorts if that ever stops being true
+        chunks = []
+
+        while True:
+            rows = cur.fetchmany(FETCH_ROWS)
+
+            if not rows:
+                break
+
+            chunks.append(np.array(rows, dtype=np.float64))
+
+        bars = np.concatenate(chunks) if chunks else np.empty((0, 3))
+        return cls.from_arrays(tickers, bars[:, 0].astype(np.int64), bars[:, 1].astype(np.int64), bars[:, 2])
+
+    def series(self, ticker: str, date_from: Optional[str] = None,
+               date_to: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # (days, closes) views of one ticker's bars, optionally limited to [date_from, date_to]
+        i = self.index.get(ticker)
+
+        if i is None:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+
+        start, end = self.offsets[i], self.offsets[i + 1]
+        days = self.days[start:end]
+        lo = np.searchsorted(days, day_ordinal(date_from), side="left") if date_from else 0
+        hi = np.searchsorted(days, day_ordinal(date_to), side="right") if date_to else len(days)
+        return days[lo:hi], self.closes[start + lo:start + hi]
+
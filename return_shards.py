@@ -0,0 +1,90 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+import numpy as np
+from config import RETURN_WORKERS, RETURN_SHARDS_PER_WORKER
+from event_study import event_price_matrix, event_return_rows, to_day_numbers
+from instrumentation import count
+from price_panel import PricePanel
+
+# jobs are the pipeline's price jobs: ((company_id, filing_dates), ticker, date_from, date_to)
+Job = Tuple[Tuple[int, Tuple[str, ...]], str, str, str]
+
+
+def shard_jobs(jobs: List[Job], n_shards: int) -> List[List[Job]]:
+    # Greedy longest-first: each company goes to the shard with the fewest events so far,
+    # so one issuer with hundreds of filings doesn't leave the other workers idle
+    shards = [[] for _ in range(max(1, min(n_shards, len(jobs))))]
+    loads = [0] * len(shards)
+
+    for job in sorted(jobs, key=lambda j: len(j[0][1]), reverse=True):
+        i = loads.index(min(loads))
+        shards[i].append(job)
+        loads[i] += len(job[0][1])
+
+    return [s for s in shards if s]
+
+
+def panel_event_matrices(panel: PricePanel, jobs: List[Job], lo: int,
+                         hi: int) -> Tuple[List[Tuple[int, str]], List[np.ndarray], List[np.ndarray]]:
+    # (events, close matrices, day matrices) for every job, each laid out from its own date range
+    events, close_rows, day_rows = [], [], []
+
+    for (company_id, filing_dates), ticker, date_from, date_to in jobs:
+        price_days, closes = panel.series(ticker, date_from, date_to)
+        close_mat, day_mat = event_price_matrix(price_days, closes, to_day_numbers(filing_dates), lo, hi)
+        events.extend((company_id, filing_date) for filing_date in filing_dates)
+        close_rows.append(close_mat)
+        day_rows.append(day_mat)
+
+    return events, close_rows, day_rows
+
+
+def panel_return_rows(panel: PricePanel, jobs: List[Job], windows: List[Tuple[int, int]], lo: int, hi: int,
+                      bench_days: Optional[np.ndarray] = None,
+                      bench_closes: Optional[np.ndarray] = None) -> List[Tuple]:
+    # event_returns rows for every job
+    events, close_rows, day_rows = panel_event_matrices(panel, jobs, lo, hi)
+
+    if not events:
+        return []
+
+    return event_return_rows(events, np.vstack(close_rows), np.vstack(day_rows), lo, windows,
+                             bench_days, bench_closes)
+
+
+def compute_return_shard(shard: List[Job], windows: List[Tuple[int, int]], lo: int, hi: int,
+                         bench_days: Optional[np.ndarray] = None,
+                         bench_closes: Optional[np.ndarray] = None,
+                         db_name: Optional[str] = None) -> List[Tuple]:
+    # Runs in a worker process: loads the shard's cached bars on its own connection
+    panel = PricePanel.from_db([job[1:] for job in shard], db_name)
+    return panel_return_rows(panel, shard, windows, lo, hi, bench_days, bench_closes)
+
+
+def compute_returns_sharded(jobs: List[Job], windows: List[Tuple[int, int]], lo: int, hi: int,
+                            bench_days: Optional[np.ndarray] = None,
+                            bench_closes: Optional[np.ndarray] = None,
+                            workers: int = RETURN_WORKERS,
+                            shards_per_worker: int = RETURN_SHARDS_PER_WORKER,
+                            db_name: Optional[str] = None) -> List[Tuple]:
+    # Prices must already be cached. Spawned (not forked) workers, so no process inherits the
+    # parent's per-thread SQLite connections
+    shards = shard_jobs(jobs, workers * max(1, shards_per_worker))
+    rows = []
+
+    if not shards:
+        return rows
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(compute_return_shard, shard, windows, lo, hi, bench_days, bench_closes, db_name)
+            for shard in shards
+        ]
+
+        for future in as_completed(futures):
+            rows.extend(future.result())
+            count("return_shards")
+
+    return rows
@@ -0,0 +1,140 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from config import STAGE_WORKERS
+from db import get_metadata, set_metadata
+from instrumentation import stage as timed_stage, carry_stages
+
+MARKER_PREFIX = "stage_done:"
+
+
+def make_stage(name: str, func: Callable, deps: Optional[List[str]] = None, max_age_hours: float = 0,
+               params: Optional[Dict] = None) -> Dict:
+    # max_age_hours: how long a successful run stays fresh (0: always run)
+    # params: the arguments the stage runs with; a run with other params is never fresh
+    return {"name": name, "func": func, "deps": list(deps or []), "max_age_hours": max_age_hours,
+            "params": dict(params or {})}
+
+
+def _read_marker(name: str) -> Dict:
+    # {"at": iso time, "params": {...}}; older markers stored just the time
+    value = get_metadata(MARKER_PREFIX + name)
+
+    if not value:
+        return {}
+
+    try:
+        return json.loads(value)
+
+    except ValueError:
+        return {"at": value, "params": None}
+
+
+def get_marker(name: str) -> Optional[datetime]:
+    at = _read_marker(name).get("at")
+    return datetime.fromisoformat(at) if at else None
+
+
+def get_marker_params(name: str) -> Optional[Dict]:
+    return _read_marker(name).get("params")
+
+
+def set_marker(name: str, when: Optional[datetime] = None, params: Optional[Dict] = None) -> None:
+    set_metadata(MARKER_PREFIX + name, json.dumps({
+        "at": (when or datetime.now()).isoformat(timespec="seconds"),
+        "params": params or {},
+    }, sort_keys=True))
+
+
+def is_fresh(stage: Dict, now: Optional[datetime] = None) -> bool:
+    # Fresh = ran successfully with the same params, within max_age_hours and after every one
+    # of its dependencies
+    marker = get_marker(stage["name"])
+
+    if not marker or stage["max_age_hours"] <= 0:
+        return False
+
+    if get_marker_params(stage["name"]) != stage["params"]:
+        return False
+
+    if (now or datetime.now()) - marker > timedelta(hours=stage["max_age_hours"]):
+        return False
+
+    return all((get_marker(dep) or datetime.min) <= marker for dep in stage["deps"])
+
+
+def select_stages(stages: List[Dict], only: Optional[List[str]] = None, skip: Optional[List[str]] = None) -> List[str]:
+    names = [s["name"] for s in stages]
+    unknown = [n for n in (only or []) + (skip or []) if n not in names]
+
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)} (known: {', '.join(names)})")
+
+    return [n for n in names if (not only or n in only) and n not in (skip or [])]
+
+
+def run_stages(stages: List[Dict], only: Optional[List[str]] = None, skip: Optional[List[str]] = None,
+               force: bool = False, max_workers: int = STAGE_WORKERS) -> Dict[str, str]:
+    # Runs the selected stages as a DAG: every stage starts as soon as all of its selected
+    # dependencies have finished, independent ones run concurrently on a thread pool.
+    # Deselected dependencies count as satisfied (their data is assumed to be in the database).
+    # Returns {name: "ran" | "fresh" | "failed" | "blocked" | "not selected"}.
+    by_name = {s["name"]: s for s in stages}
+    selected = select_stages(stages, only, skip)
+    status = {s["name"]: "not selected" for s in stages}
+    pending = list(selected)
+    running = {}
+
+    def ready(name):
+        return all(dep not in selected or status[dep] in ("ran", "fresh") for dep in by_name[name]["deps"])
+
+    def blocked(name):
+        return any(dep in selected and status[dep] in ("failed", "blocked") for dep in by_name[name]["deps"])
+
+    def run(stage):
+        with timed_stage(f"stage:{stage['name']}"):
+            stage["func"]()
+
+        set_marker(stage["name"], params=stage["params"])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            for name in list(pending):
+                if blocked(name):
+                    status[name] = "blocked"
+                    pending.remove(name)
+                    print(f"Stage {name} blocked by a failed dependency.")
+
+                elif ready(name):
+                    pending.remove(name)
+
+                    if not force and is_fresh(by_name[name]):
+                        status[name] = "fresh"
+                        print(f"Stage {name} is up to date (last run {get_marker(name)}), skipping.")
+                        continue
+
+                    print(f"Starting stage {name}...")
+                    running[pool.submit(carry_stages(run), by_name[name])] = name
+
+            if not running:
+                # Newly fresh stages can unblock more work without anything running
+                if pending and not any(ready(n) or blocked(n) for n in pending):
+                    raise RuntimeError(f"Stage dependency cycle among: {', '.join(pending)}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+
+                try:
+                    future.result()
+                    status[name] = "ran"
+                    print(f"Finished stage {name}.")
+
+                except Exception as e:
+                    status[name] = "failed"
+                    print(f"Stage {name} failed: {e!r}")
+
+    return status
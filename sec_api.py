@@ -1,35 +1,24 @@
-import requests
-from typing import List, Dict
-from config import SEC_API_KEY, SEC_BASE_URL
-from db import get_connection
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import List, Dict, Optional, Tuple, Iterator, Iterable, Callable
+from config import (
+    SEC_API_KEY, SEC_BASE_URL, SEC_PAGE_SIZE, SEC_MAX_WORKERS, SEC_BACKFILL_YEARS, SEC_WRITE_BATCH_SIZE
+)
+from http_client import post as http_post
+from instrumentation import timed, count, carry_stages
+from db import get_connection, transaction, get_metadata, set_metadata, get_metadata_prefix
+
+BACKFILL_PREFIX = "sec_backfill:"
+WATERMARK_KEY = "sec_filed_at_watermark"
 
 def get_offset() -> int:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM metadata WHERE key = 'offset'")
-    row = cur.fetchone()
-    conn.close()
-    return int(row[0]) if row else 0
+    return int(get_metadata("offset", 0))
 
 def save_offset(offset: int) -> None:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO metadata (key, value) VALUES ('offset', ?)
-        ON CONFLICT(key) DO UPDATE SET value = excluded.value
-    """, (str(offset),))
-    conn.commit()
-    conn.close()
-
+    set_metadata("offset", offset)
 
-def fetch_sec_filings(limit: int = 25) -> List[Dict]:
-    if not SEC_API_KEY or SEC_API_KEY.startswith("YOUR_"):
-        raise ValueError("SEC_API_KEY missing in config.py")
-
-    # Read last processed index
-    offset = get_offset()
-    url = f"{SEC_BASE_URL}?token={SEC_API_KEY}"
 
+def build_sec_query(filed_from: Optional[str] = None, filed_to: Optional[str] = None) -> str:
     # PRIMARY FOLLOW-ON KEYWORDS
     include_terms = [
         '"follow-on offering"',
@@ -53,72 +42,286 @@ def fetch_sec_filings(limit: int = 25) -> List[Dict]:
     if exclude_terms:
         query += " AND NOT (" + " OR ".join(exclude_terms) + ")"
 
+    if filed_from or filed_to:
+        query += f" AND filedAt:[{filed_from or '*'} TO {filed_to or '*'}]"
+
+    return query
+
+
+@timed()
+def fetch_sec_raw_page(query: str, offset: int, size: int) -> List[Dict]:
+    if not SEC_API_KEY or SEC_API_KEY.startswith("YOUR_"):
+        raise ValueError("SEC_API_KEY missing in config.py")
+
+    url = f"{SEC_BASE_URL}?token={SEC_API_KEY}"
+
     payload = {
         "query": query,
         "from": str(offset),
-        "size": str(limit),
+        "size": str(size),
         "sort": [{"filedAt": {"order": "desc"}}]
     }
 
-    response = requests.post(url, json=payload)
+    response = http_post(url, json=payload, source="sec")
     response.raise_for_status()
-    data = response.json()
+    return response.json().get("filings", [])
 
-    filings: List[Dict] = []
 
-    for item in data.get("filings", []):
-        raw_name = item.get("companyName", "") or ""
-        clean_name = " ".join(w.capitalize() for w in raw_name.split())
+def normalize_filing(item: Dict) -> Dict:
+    raw_name = item.get("companyName", "") or ""
+    clean_name = " ".join(w.capitalize() for w in raw_name.split())
 
-        filings.append({
-            "cik": item.get("cik"),
-            "company_name": clean_name,
-            "ticker": item.get("ticker"),
-            "filing_date": item.get("filedAt", "")[:10],
-            "filing_type": item.get("formType"),
-            "filing_url": item.get("linkToHtml"),
-            "is_pfollow_on": 1   # always 1 because query already filters
-        })
+    return {
+        "cik": item.get("cik"),
+        "company_name": clean_name,
+        "ticker": item.get("ticker"),
+        "filing_date": (item.get("filedAt") or "")[:10],
+        "filed_at": item.get("filedAt") or "",
+        "filing_type": item.get("formType"),
+        "filing_url": item.get("linkToHtml"),
+        "is_pfollow_on": 1   # always 1 because query already filters
+    }
 
-    save_offset(offset + limit)
-    return filings
 
+# STREAMING (pages -> lazily normalized filings -> bounded write batches)
+def iter_sec_pages(query: str, offset: int = 0, page_size: int = SEC_PAGE_SIZE,
+                   limit: Optional[int] = None) -> Iterator[List[Dict]]:
+    # Raw pages as they arrive, until a short page or `limit` items
+    remaining = limit
 
-def store_sec_filings_to_db(filings: List[Dict]) -> None:
-    conn = get_connection()
-    cur = conn.cursor()
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        page = fetch_sec_raw_page(query, offset, size)
 
-    for f in filings:
-        cik = f["cik"]
-        name = f["company_name"]
-        ticker = f.get("ticker")
+        if not page:
+            return
 
-        # Insert company
-        cur.execute("""
+        yield page
+        offset += len(page)
+
+        if remaining is not None:
+            remaining -= len(page)
+
+        if len(page) < size:
+            return
+
+
+def iter_sec_filings(pages: Iterable[List[Dict]]) -> Iterator[Dict]:
+    for page in pages:
+        for item in page:
+            yield normalize_filing(item)
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+
+    for item in items:
+        batch.append(item)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def store_sec_filing_stream(filings: Iterable[Dict], batch_size: int = SEC_WRITE_BATCH_SIZE,
+                            on_batch: Optional[Callable[[List[Dict]], None]] = None) -> int:
+    # Each batch is committed before the next is pulled, so at most one batch is held in
+    # memory and everything stored so far survives a crash; on_batch runs after each commit
+    stored = 0
+
+    for batch in batched(filings, batch_size):
+        store_sec_filings_to_db(batch)
+        stored += len(batch)
+
+        if on_batch:
+            on_batch(batch)
+
+    return stored
+
+
+def load_sec_page_stream(limit: int = 25, page_size: int = SEC_PAGE_SIZE,
+                         batch_size: int = SEC_WRITE_BATCH_SIZE) -> int:
+    # Next `limit` filings after the saved offset; the offset advances per committed batch
+    offset = get_offset()
+
+    def advance(batch):
+        nonlocal offset
+        offset += len(batch)
+        save_offset(offset)
+
+    pages = iter_sec_pages(build_sec_query(), offset, page_size, limit)
+    return store_sec_filing_stream(iter_sec_filings(pages), batch_size, on_batch=advance)
+
+
+# FULL-HISTORY BACKFILL
+def _month_slices(years_back: int) -> List[Tuple[str, str]]:
+    today = date.today()
+    start = date(today.year - years_back, today.month, 1)
+
+    slices = []
+    month_start = start
+
+    while month_start <= today:
+        next_month = date(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1)
+        slices.append((month_start.isoformat(), (next_month - timedelta(days=1)).isoformat()))
+        month_start = next_month
+
+    return slices
+
+
+def backfill_sec_filings(page_size: int = SEC_PAGE_SIZE,
+                         max_workers: int = SEC_MAX_WORKERS,
+                         years_back: int = SEC_BACKFILL_YEARS) -> int:
+    # Walks the result set one filing month at a time (keeps every query under the API's
+    # pagination ceiling), fetching several pages of a month concurrently. Each stored page
+    # of a closed month is checkpointed as metadata key sec_backfill:<month>:<from>, and the
+    # month is marked :done once an empty page comes back, so a crashed run resumes where it
+    # stopped. The current month is always re-read from offset 0: new filings land at the top
+    # of its newest-first results and shift every page, so its offsets can't be checkpointed.
+    max_workers = max(1, max_workers)
+    checkpoints = get_metadata_prefix(BACKFILL_PREFIX)
+    today = date.today().isoformat()
+    stored = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        for month_from, month_to in _month_slices(years_back):
+            month_key = f"{BACKFILL_PREFIX}{month_from[:7]}"
+
+            if f"{month_key}:done" in checkpoints:
+                continue
+
+            query = build_sec_query(month_from, month_to)
+            closed = month_to < today
+            offset = 0
+            exhausted = False
+
+            while not exhausted:
+                # Next wave of pages that have not been checkpointed yet
+                wave = []
+
+                while len(wave) < max_workers:
+                    if not closed or f"{month_key}:{offset}" not in checkpoints:
+                        wave.append(offset)
+                    offset += page_size
+
+                futures = [(o, pool.submit(carry_stages(fetch_sec_raw_page), query, o, page_size)) for o in wave]
+
+                for page_offset, future in futures:
+                    try:
+                        page = future.result()
+
+                    except Exception as e:
+                        print(f"SEC page {month_from[:7]} from={page_offset} failed: {e}")
+                        print("Backfill stopped; re-run to resume from the last checkpoint.")
+                        return stored
+
+                    if not page:
+                        exhausted = True
+                        continue
+
+                    stored += store_sec_filing_stream(iter_sec_filings([page]))
+
+                    if closed:
+                        set_metadata(f"{month_key}:{page_offset}", len(page))
+
+            # The current month keeps receiving filings, so it is never marked done
+            if closed:
+                set_metadata(f"{month_key}:done", offset)
+
+            print(f"Backfilled SEC filings for {month_from[:7]} ({stored} stored so far).")
+
+    return stored
+
+
+# INCREMENTAL SYNC (filedAt high-water mark)
+def get_filed_at_watermark() -> Optional[str]:
+    watermark = get_metadata(WATERMARK_KEY)
+
+    if watermark:
+        return watermark
+
+    # Seed from whatever is already in the database
+    cur = get_connection().cursor()
+    cur.execute("SELECT MAX(filing_date) FROM filings")
+    row = cur.fetchone()
+    return row[0] if row and row[0] else None
+
+
+def sync_sec_filings(page_size: int = SEC_PAGE_SIZE, batch_size: int = SEC_WRITE_BATCH_SIZE) -> int:
+    # Only asks for filings on/after the newest filedAt already ingested. The range is
+    # inclusive at day granularity, so the boundary day is re-read and deduplicated by
+    # filing_url; the watermark only moves after every page has been stored.
+    watermark = get_filed_at_watermark()
+    query = build_sec_query(watermark[:10] if watermark else None)
+    newest = watermark or ""
+
+    def track(batch):
+        nonlocal newest
+        newest = max([newest] + [f["filed_at"] for f in batch if f.get("filed_at")])
+
+    stored = store_sec_filing_stream(iter_sec_filings(iter_sec_pages(query, 0, page_size)), batch_size,
+                                     on_batch=track)
+
+    if newest and newest != watermark:
+        set_metadata(WATERMARK_KEY, newest)
+
+    return stored
+
+
+@timed()
+def store_sec_filings_to_db(filings: List[Dict]) -> None:
+    if not filings:
+        return
+
+    # One transaction: bulk-insert companies, stage filings in a temp table and
+    # resolve company ids with a single join instead of a SELECT per filing
+    with transaction() as cur:
+        cur.executemany("""
             INSERT OR IGNORE INTO companies (cik, name, ticker)
             VALUES (?, ?, ?)
-        """, (cik, name, ticker))
+        """, [(f["cik"], f["company_name"], f.get("ticker")) for f in filings if f["cik"]])
+
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS staged_filings (
+                cik TEXT,
+                filing_date TEXT,
+                filing_type TEXT,
+                filing_url TEXT,
+                is_pfollow_on INTEGER
+            )
+        """)
+        cur.execute("DELETE FROM staged_filings")
+
+        cur.executemany("""
+            INSERT INTO staged_filings (cik, filing_date, filing_type, filing_url, is_pfollow_on)
+            VALUES (?, ?, ?, ?, ?)
+        """, [
+            (f["cik"], f["filing_date"], f["filing_type"], f["filing_url"], f["is_pfollow_on"])
+            for f in filings
+        ])
 
-        # Fetch company_id
-        cur.execute("SELECT id FROM companies WHERE cik = ?", (cik,))
-        row = cur.fetchone()
-        if not row:
-            print(f"Could not find company_id for CIK {cik}, skipping filing.")
-            continue
-        company_id = row[0]
+        cur.execute("""
+            SELECT COUNT(*) FROM staged_filings s
+            LEFT JOIN companies c ON c.cik = s.cik
+            WHERE c.id IS NULL
+        """)
+        skipped = cur.fetchone()[0]
 
-        # Insert filing
         cur.execute("""
-            INSERT OR IGNORE INTO filings 
+            INSERT OR IGNORE INTO filings
             (company_id, filing_date, filing_type, filing_url, is_pfollow_on)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            company_id,
-            f["filing_date"],
-            f["filing_type"],
-            f["filing_url"],
-            f["is_pfollow_on"]
-        ))
-
-    conn.commit()
-    conn.close()
+            SELECT c.id, s.filing_date, s.filing_type, s.filing_url, s.is_pfollow_on
+            FROM staged_filings s
+            JOIN companies c ON c.cik = s.cik
+        """)
+
+        cur.execute("DELETE FROM staged_filings")
+
+    count("rows_written", len(filings) - skipped)
+
+    if skipped:
+        print(f"Could not find company_id for {skipped} filings, skipped them.")
@@ -1,76 +1,372 @@
-import requests
-from datetime import datetime, timedelta
-from typing import List, Dict
-from config import STOCKDATA_API_KEY, STOCKDATA_BASE_URL
-from db import get_connection
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Hashable, Iterable, Iterator, Optional, Tuple
+from config import (
+    STOCKDATA_API_KEY, STOCKDATA_BASE_URL,
+    STOCKDATA_MAX_WORKERS, STOCKDATA_REQUESTS_PER_SECOND, STOCKDATA_BURST,
+    STOCKDATA_MAX_RETRIES, STOCKDATA_BACKOFF_SECONDS,
+    STOCKDATA_MAX_SYMBOLS_PER_REQUEST, STOCKDATA_MAX_BATCH_DAYS
+)
+from db import get_connection, transaction, get_metadata, set_metadata
+from http_client import TokenBucket, get as http_get
+from instrumentation import timed, count, carry_stages
 
-def fetch_stock_prices_for_11days(ticker: str, filing_date_str: str) -> List[Dict]:
-    if not ticker or not filing_date_str:
-        return []
+# metadata key <prefix><ticker> = the day today's (not yet final) bar was last requested
+TODAY_FETCHED_PREFIX = "price_today_fetched:"
 
+
+def _to_float(value):
     try:
-        start_dt = datetime.fromisoformat(filing_date_str)
-    
-    except Exception:
-        return []
+        return float(value) if value is not None else None
 
-    # Request a slightly larger range to handle weekends / missing days
-    date_from = start_dt.strftime("%Y-%m-%d")
-    date_to = (start_dt + timedelta(days=12)).strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
 
-    url = f"{STOCKDATA_BASE_URL}/data/eod"
+
+@timed()
+def fetch_eod_batch(tickers: List[str], date_from: str, date_to: str,
+                    limiter: Optional[TokenBucket] = None,
+                    base_url: Optional[str] = None) -> Optional[Dict[str, List[Dict]]]:
+    # One request for several symbols; the response is split back per ticker.
+    # Returns None when the request failed, so the range is not marked as covered; tickers
+    # missing from the result are not marked either
+    url = f"{base_url or STOCKDATA_BASE_URL}/data/eod"
     params = {
         "api_token": STOCKDATA_API_KEY,
-        "symbols": ticker,
+        "symbols": ",".join(tickers),
         "date_from": date_from,
         "date_to": date_to,
     }
 
-    resp = requests.get(url, params=params)
-    
     try:
+        resp = http_get(url, params, limiter=limiter,
+                        max_retries=STOCKDATA_MAX_RETRIES, backoff=STOCKDATA_BACKOFF_SECONDS, source="stockdata")
         resp.raise_for_status()
-    
+        data = resp.json()
+
     except Exception:
-        return []
+        return None
 
-    data = resp.json()
     raw = data.get("data", []) if isinstance(data, dict) else []
 
-    normalized = []
-    
+    by_ticker: Dict[str, List[Dict]] = {t: [] for t in tickers}
+    unattributed = False
+
     for rec in raw:
         d = rec.get("date")
-        close = rec.get("close")
-    
-        try:
-            if d and close is not None:
-                normalized.append({"date": d, "close": float(close)})
-    
-        except (TypeError, ValueError):
+        close = _to_float(rec.get("close"))
+        ticker = rec.get("ticker") or rec.get("symbol")
+
+        # Single-symbol responses don't always echo the ticker back
+        if ticker is None and len(tickers) == 1:
+            ticker = tickers[0]
+
+        if ticker is None:
+            unattributed = True
+
+        if not d or close is None or ticker not in by_ticker:
             continue
 
+        by_ticker[ticker].append({
+            "date": d[:10],
+            "open": _to_float(rec.get("open")),
+            "high": _to_float(rec.get("high")),
+            "low": _to_float(rec.get("low")),
+            "close": close,
+            "volume": _to_float(rec.get("volume"))
+        })
+
+    # Bars without a symbol can't be split back per ticker, and caching the rest would mark the
+    # missing ones as covered for good: ask for each symbol on its own instead (failed ones are
+    # left out, so their ranges stay uncovered)
+    if unattributed and len(tickers) > 1:
+        singles = ((t, fetch_eod_batch([t], date_from, date_to, limiter=limiter, base_url=base_url)) for t in tickers)
+        return {t: batch[t] for t, batch in singles if batch is not None}
+
     # Sort by date ascending
-    normalized.sort(key=lambda r: r["date"])
-    return normalized
-
-def store_stock_prices_to_db(company_id: int, prices: List[Dict]) -> None:
-    conn = get_connection()
-    cur = conn.cursor()
-
-    for p in prices:
-    
-        cur.execute("""
-            INSERT OR IGNORE INTO stock_prices (company_id, date, close, high, low, volume)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            company_id,
-            p["date"],
-            p["close"],
-            p["high"],
-            p["low"],
-            p["volume"]
-        ))
-
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    for prices in by_ticker.values():
+        prices.sort(key=lambda r: r["date"])
+
+    return by_ticker
+
+
+def fetch_eod_range(ticker: str, date_from: str, date_to: str,
+                    limiter: Optional[TokenBucket] = None,
+                    base_url: Optional[str] = None) -> Optional[List[Dict]]:
+    batch = fetch_eod_batch([ticker], date_from, date_to, limiter=limiter, base_url=base_url)
+    return None if batch is None else batch[ticker]
+
+
+def group_price_requests(ranges: List[Tuple[str, str, str]],
+                         max_symbols: int = STOCKDATA_MAX_SYMBOLS_PER_REQUEST,
+                         max_span_days: int = STOCKDATA_MAX_BATCH_DAYS) -> List[Tuple[List[str], str, str]]:
+    # ranges are (ticker, date_from, date_to); overlapping windows share one request
+    # covering their union, capped by symbol count and by how many days the union adds
+    # to the shortest member (so no symbol is fetched more than max_span_days beyond its own range)
+    def span(d_from: str, d_to: str) -> int:
+        return (date.fromisoformat(d_to) - date.fromisoformat(d_from)).days
+
+    groups = []
+    current: List[str] = []
+    g_from = g_to = None
+    g_shortest = 0
+
+    for ticker, date_from, date_to in sorted(ranges, key=lambda r: (r[1], r[2])):
+        own = span(date_from, date_to)
+        fits = (
+            current
+            and date_from <= g_to
+            and len(current) < max_symbols
+            and span(g_from, max(g_to, date_to)) <= min(g_shortest, own) + max_span_days
+        )
+
+        if fits:
+            g_to = max(g_to, date_to)
+            g_shortest = min(g_shortest, own)
+
+            if ticker not in current:
+                current.append(ticker)
+
+            continue
+
+        if current:
+            groups.append((current, g_from, g_to))
+
+        current, g_from, g_to, g_shortest = [ticker], date_from, date_to, own
+
+    if current:
+        groups.append((current, g_from, g_to))
+
+    return groups
+
+
+# PRICE CACHE
+def price_window(filing_date_str: str) -> Optional[Tuple[str, str]]:
+    try:
+        start_dt = datetime.fromisoformat(filing_date_str)
+
+    except Exception:
+        return None
+
+    # Request a slightly larger range to handle weekends / missing days
+    return start_dt.strftime("%Y-%m-%d"), (start_dt + timedelta(days=12)).strftime("%Y-%m-%d")
+
+
+def get_price_coverage(ticker: str) -> List[Tuple[str, str]]:
+    cur = get_connection().cursor()
+    cur.execute("""
+        SELECT date_from, date_to FROM price_coverage
+        WHERE ticker = ?
+        ORDER BY date_from
+    """, (ticker,))
+    rows = cur.fetchall()
+    return rows
+
+
+def missing_ranges(covered: List[Tuple[str, str]], date_from: str, date_to: str) -> List[Tuple[str, str]]:
+    gaps = []
+    cursor = date.fromisoformat(date_from)
+    end = date.fromisoformat(date_to)
+
+    for c_from, c_to in covered:
+        c_from, c_to = date.fromisoformat(c_from), date.fromisoformat(c_to)
+
+        if c_to < cursor:
+            continue
+
+        if c_from > end:
+            break
+
+        if c_from > cursor:
+            gaps.append((cursor.isoformat(), (c_from - timedelta(days=1)).isoformat()))
+
+        cursor = max(cursor, c_to + timedelta(days=1))
+
+        if cursor > end:
+            break
+
+    if cursor <= end:
+        gaps.append((cursor.isoformat(), end.isoformat()))
+
+    return gaps
+
+
+def price_gaps(ticker: str, date_from: str, date_to: str) -> List[Tuple[str, str]]:
+    # Uncached parts of [date_from, date_to]. Nothing past today can have bars yet, and today's
+    # bar (never marked covered, it may still change) is fetched at most once per day
+    today = date.today().isoformat()
+    date_to = min(date_to, today)
+
+    if date_from > date_to:
+        return []
+
+    gaps = missing_ranges(get_price_coverage(ticker), date_from, date_to)
+
+    if gaps and gaps[-1] == (today, today) and get_metadata(TODAY_FETCHED_PREFIX + ticker) == today:
+        gaps.pop()
+
+    return gaps
+
+
+def _merge_coverage(cur, ticker: str, date_from: str, date_to: str) -> None:
+    # Today's bar may still change, so only ranges up to yesterday count as covered
+    last_final = (date.today() - timedelta(days=1)).isoformat()
+    date_to = min(date_to, last_final)
+
+    if date_from > date_to:
+        return
+
+    # Merge with any overlapping or adjacent ranges so coverage stays one row per gap-free span
+    lo = (date.fromisoformat(date_from) - timedelta(days=1)).isoformat()
+    hi = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+
+    cur.execute("""
+        SELECT MIN(date_from), MAX(date_to) FROM price_coverage
+        WHERE ticker = ? AND date_from <= ? AND date_to >= ?
+    """, (ticker, hi, lo))
+    merged_from, merged_to = cur.fetchone()
+
+    if merged_from is not None:
+        date_from = min(date_from, merged_from)
+        date_to = max(date_to, merged_to)
+
+    cur.execute("""
+        DELETE FROM price_coverage
+        WHERE ticker = ? AND date_from <= ? AND date_to >= ?
+    """, (ticker, hi, lo))
+    cur.execute("""
+        INSERT INTO price_coverage (ticker, date_from, date_to)
+        VALUES (?, ?, ?)
+    """, (ticker, date_from, date_to))
+
+
+def load_stock_prices_from_db(ticker: str, date_from: str, date_to: str) -> List[Dict]:
+    cur = get_connection().cursor()
+    cur.execute("""
+        SELECT date, close FROM stock_prices
+        WHERE ticker = ? AND date BETWEEN ? AND ?
+        ORDER BY date
+    """, (ticker, date_from, date_to))
+    rows = cur.fetchall()
+    return [{"date": d, "close": close} for d, close in rows]
+
+
+@timed()
+def cache_price_batch(batch: Optional[Dict[str, List[Dict]]], date_from: str, date_to: str) -> None:
+    # Bars for every ticker of a request plus their coverage, in one transaction
+    if batch is None:
+        return
+
+    today = date.today().isoformat()
+
+    with transaction() as cur:
+        _insert_price_rows(cur, [(ticker, p) for ticker, prices in batch.items() for p in prices])
+
+        for ticker in batch:
+            _merge_coverage(cur, ticker, date_from, date_to)
+
+            if date_from <= today <= date_to:
+                set_metadata(TODAY_FETCHED_PREFIX + ticker, today)
+
+
+@timed()
+def fetch_stock_prices_for_11days(ticker: str, filing_date_str: str,
+                                  limiter: Optional[TokenBucket] = None,
+                                  base_url: Optional[str] = None) -> List[Dict]:
+    if not ticker or not filing_date_str:
+        return []
+
+    window = price_window(filing_date_str)
+
+    if window is None:
+        return []
+
+    # Only hit the API for the parts of the window not already cached
+    for gap_from, gap_to in price_gaps(ticker, *window):
+        prices = fetch_eod_range(ticker, gap_from, gap_to, limiter=limiter, base_url=base_url)
+        cache_price_batch(None if prices is None else {ticker: prices}, gap_from, gap_to)
+
+    return load_stock_prices_from_db(ticker, *window)
+
+
+# CONCURRENT FETCH ENGINE
+def fetch_stock_prices_concurrently(jobs: Iterable[Tuple[Hashable, str, str, str]],
+                                    max_workers: int = STOCKDATA_MAX_WORKERS,
+                                    requests_per_second: float = STOCKDATA_REQUESTS_PER_SECOND,
+                                    burst: int = STOCKDATA_BURST,
+                                    base_url: Optional[str] = None,
+                                    load_prices: bool = True) -> Iterator[Tuple[Hashable, str, Optional[List[Dict]]]]:
+    # jobs are (key, ticker, date_from, date_to); (key, ticker, prices) is yielded as each completes.
+    # Workers only do HTTP; cache reads and writes stay on the calling thread.
+    # load_prices=False only fills the cache and yields None instead of the prices.
+    limiter = TokenBucket(requests_per_second, burst)
+
+    pending = {}
+    gap_owners = defaultdict(list)
+
+    for job in jobs:
+        key, ticker, date_from, date_to = job
+
+        if not ticker or not date_from or not date_to:
+            yield key, ticker, []
+            continue
+
+        gaps = price_gaps(ticker, date_from, date_to)
+
+        if not gaps:
+            # Fully cached, no network needed
+            yield key, ticker, load_stock_prices_from_db(ticker, date_from, date_to) if load_prices else None
+            continue
+
+        pending[job] = len(gaps)
+
+        for gap_from, gap_to in gaps:
+            gap_owners[(ticker, gap_from, gap_to)].append(job)
+
+    groups = group_price_requests(list(gap_owners))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(carry_stages(fetch_eod_batch), tickers, g_from, g_to, limiter, base_url): (tickers, g_from, g_to)
+            for tickers, g_from, g_to in groups
+        }
+
+        for future in as_completed(futures):
+            tickers, g_from, g_to = futures[future]
+
+            try:
+                batch = future.result()
+
+            except Exception as e:
+                print(f"Price fetch failed for {','.join(tickers)}: {e}")
+                batch = None
+
+            cache_price_batch(batch, g_from, g_to)
+
+            # A gap is resolved once the group covering it has landed
+            done = [
+                key for key in gap_owners
+                if key[0] in tickers and g_from <= key[1] and key[2] <= g_to
+            ]
+
+            for key in done:
+                for job in gap_owners.pop(key):
+                    pending[job] -= 1
+
+                    if pending[job] == 0:
+                        key, ticker, date_from, date_to = job
+                        yield key, ticker, (load_stock_prices_from_db(ticker, date_from, date_to)
+                                            if load_prices else None)
+
+
+def _insert_price_rows(cur, rows: List[Tuple[str, Dict]]) -> None:
+    cur.executemany("""
+        INSERT OR REPLACE INTO stock_prices (ticker, date, open, high, low, close, volume)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (ticker, p["date"], p.get("open"), p.get("high"), p.get("low"), p["close"], p.get("volume"))
+        for ticker, p in rows
+    ])
+
+    count("rows_written", len(rows))